@@ -1,11 +1,46 @@
+import asyncio
 import datetime
+import fnmatch
+import heapq
+import importlib.util
+import os
+import re
+import shlex
+import shutil
 import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import boto3
 import click
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 
-from .server import ServerManager
+from .server import ServerManager, debug_echo
+
+MB = 1024 * 1024
+
+# Large archives get split into 64MB parts, with up to 16 parts in flight per file
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=64 * MB,
+    multipart_chunksize=64 * MB,
+    max_concurrency=16,
+    use_threads=True,
+)
+
+# Sorted entries and fixed ownership mean the same world content gives the same
+# tar stream, so rsyncable compression and dedup can reuse blocks between runs
+TAR = ["tar", "--sort=name", "--owner=0", "--group=0", "--numeric-owner"]
+
+# Region file copies kept in flight at once when copying a world in-process
+COPY_WORKERS = 8
+
+# Have S3 verify uploads with CRC64NVME, botocore needs awscrt to compute it
+UPLOAD_ARGS = (
+    {"ChecksumAlgorithm": "CRC64NVME"} if importlib.util.find_spec("awscrt") else {}
+)
 
 
 class BackupManager:
@@ -15,6 +50,22 @@ class BackupManager:
         self.incremental = incremental
         self.cfg_backups = self.server.config.get_dict("backups")
 
+        # Resolve the settings used on every sync/prune once
+        self._bucket = self.cfg.tree_str("backups", "aws", "bucket") or ""
+        subfolder = self.cfg.tree_str("backups", "aws", "subfolder") or ""
+        self._subfolder = f"{subfolder}/" if subfolder else ""
+        self._name_pattern = str(self.cfg_backups["name"])
+        self._name_glob = self._name_pattern % "*"
+        self._name_re = re.compile(fnmatch.translate(self._name_glob))
+
+        self.__s3 = None
+
+        # Whether the backup folder can take reflink clones, see _supports_reflink()
+        self._reflink: bool | None = None
+
+        # Set by compress_backup() so aws_sync() can ship it without a rescan
+        self.last_archive: str | None = None
+
         # Calculate the backup folder
         self.backup_dest_base = Path(self.cfg_backups["folder"])
         self.backup_dest = self.backup_dest_base.joinpath(
@@ -38,58 +89,283 @@ class BackupManager:
             click.echo(f"Game folder does not exist: {self.backup_source}")
 
     def _s3(self):
+        """Return the S3 client, creating it on first use.
+
+        Client construction loads botocore's service data and a connection pool,
+        so one client is shared by every transfer this manager makes.
+        """
+        if self.__s3 is not None:
+            return self.__s3
+
         endpoint_url = None
         aws_service = self.cfg.tree_str("backups", "aws", "service")
         if aws_service:
             endpoint_url = aws_service
 
-        client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.__s3 = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            config=BotoConfig(
+                # Enough for 4 files with 16 parts each in flight
+                max_pool_connections=64,
+                retries={"mode": "standard", "max_attempts": 5},
+                tcp_keepalive=True,
+            ),
+        )
 
-        return client
+        return self.__s3
 
-    def sync_world_folder(self):
-        """Copy the game world contents across to the backup folder."""
-        self.server.save_off()
+    def _supports_reflink(self) -> bool:
+        """Check once if the world can be cloned into the backup folder with reflinks.
 
-        command = [
+        Both folders need to be on the same filesystem, and that filesystem has
+        to support copy-on-write clones (Btrfs, XFS, APFS...).
+        """
+        if self._reflink is not None:
+            return self._reflink
+
+        self._reflink = False
+        try:
+            same_fs = (
+                os.stat(self.backup_source).st_dev == os.stat(self.backup_dest).st_dev
+            )
+        except OSError:
+            return self._reflink
+
+        if same_fs:
+            with tempfile.TemporaryDirectory(dir=self.backup_dest) as tmp:
+                src = os.path.join(tmp, "a")
+                open(src, "w").close()
+                self._reflink = (
+                    subprocess.call(
+                        [*self._reflink_command(), src, os.path.join(tmp, "b")],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                    == 0
+                )
+
+        debug_echo(self.cfg.debug, f"Reflink copies supported: {self._reflink}")
+        return self._reflink
+
+    @staticmethod
+    def _reflink_command() -> list:
+        if sys.platform == "darwin":
+            return ["cp", "-c", "-R", "-p"]
+        # -x keeps to one filesystem, like rsync -x
+        return ["cp", "--reflink=always", "-a", "-x"]
+
+    def _reflink_sync(self) -> bool:
+        """Whether syncs clone the whole world rather than rsync the changes.
+
+        A reflink clone only copies metadata, so replacing the whole folder is
+        cheaper than working out what changed. Incremental backups keep a git
+        repo in the folder, so they stay on rsync.
+        """
+        return not self.incremental and self._supports_reflink()
+
+    def _reflink_staging(self) -> Path:
+        """Where the clone is made, next to the copy it replaces."""
+        return self.backup_dest.joinpath(f".{self.backup_dest_world.name}.new")
+
+    def _sync_command(self) -> list:
+        """Build the command that copies the world into the backup folder."""
+        if self._reflink_sync():
+            return [
+                *self._reflink_command(),
+                "--",
+                str(self.backup_source),
+                str(self._reflink_staging()),
+            ]
+
+        # Both sides are local, so skip the delta algorithm (-W) and rewrite
+        # changed region files in place rather than through a temp file.
+        # Don't add -S here, sparse detection halves the throughput on region files
+        return [
             "rsync",
-            "-xavh",
+            "-xaW",
+            "--inplace",
             "--delete",
             "--exclude=.git",
             str(self.backup_source),
             str(self.backup_dest),
         ]
 
-        subprocess.call(command, cwd=self.backup_source, stderr=subprocess.STDOUT)
+    def _first_copy(self) -> bool:
+        """Copy the world in-process if the backup folder has no copy of it yet.
+
+        With nothing to compare against there is no point forking rsync,
+        copytree goes through sendfile() on Linux and fcopyfile() on macOS.
+        Worlds are thousands of small region files, so the copies are handed
+        to a thread pool to keep several in flight at once.
+
+        Returns:
+            bool: True if the world was copied.
+        """
+        if self.backup_dest_world.exists() or self._supports_reflink():
+            return False
+
+        ignore_git = shutil.ignore_patterns(".git")
+        folders = []
+        device = os.stat(self.backup_source).st_dev
+
+        def ignore(src, names):
+            folders.append(src)
+            # Stay on the one filesystem, like rsync -x
+            ignored = ignore_git(src, names)
+            for name in names:
+                if os.lstat(os.path.join(src, name)).st_dev != device:
+                    ignored.add(name)
+            return ignored
+
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+            copies = []
+            shutil.copytree(
+                self.backup_source,
+                self.backup_dest_world,
+                symlinks=True,
+                ignore=ignore,
+                copy_function=lambda src, dst: copies.append(
+                    pool.submit(shutil.copy2, src, dst),
+                ),
+                dirs_exist_ok=True,
+            )
+            for copy in copies:
+                copy.result()
+
+        # copytree sets each folder's times before the pool has written into
+        # it, so put them back now every file is in place
+        for src in reversed(folders):
+            relative = os.path.relpath(src, self.backup_source)
+            shutil.copystat(src, os.path.join(self.backup_dest_world, relative))
+        return True
+
+    def _prepare_sync(self) -> None:
+        """Throw away a clone left behind by an earlier failed sync."""
+        if self._reflink_sync():
+            shutil.rmtree(self._reflink_staging(), ignore_errors=True)
+
+    def _finish_sync(self, ok: bool) -> None:
+        """Swap a finished clone in for the old copy, or drop a failed one.
+
+        The old copy is only removed once the new one is in place, so a failed
+        clone leaves the last good copy alone.
+        """
+        if not self._reflink_sync():
+            return
+
+        staging = self._reflink_staging()
+        if not ok:
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+
+        # Leave out the same things as rsync's --exclude=.git
+        for git in sorted(staging.rglob(".git"), reverse=True):
+            if git.is_dir() and not git.is_symlink():
+                shutil.rmtree(git)
+            else:
+                git.unlink()
+
+        old = staging.with_suffix(".old")
+        shutil.rmtree(old, ignore_errors=True)
+        if self.backup_dest_world.exists():
+            os.replace(self.backup_dest_world, old)
+        os.replace(staging, self.backup_dest_world)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def sync_world_folder(self):
+        """Copy the game world contents across to the backup folder."""
+        self.server.save_off()
+
+        if not self._first_copy():
+            self._prepare_sync()
+            ok = self._run(self._sync_command(), cwd=self.backup_source)
+            self._finish_sync(ok)
 
         self.server.save_on()
         return self
 
+    async def sync_world_folder_async(self):
+        """Same as sync_world_folder(), without blocking the event loop."""
+        await asyncio.to_thread(self.server.save_off)
+
+        if not await asyncio.to_thread(self._first_copy):
+            await asyncio.to_thread(self._prepare_sync)
+            ok = await self._run_async(self._sync_command(), cwd=self.backup_source)
+            await asyncio.to_thread(self._finish_sync, ok)
+
+        await asyncio.to_thread(self.server.save_on)
+        return self
+
     def compress_backup(self):
         if self.incremental:
             raise click.UsageError("Cannot compress incremental.")
 
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M")
-        compressed_name = (
-            self.cfg_backups["name"] % f"{self.backup_dest_world}_{timestamp}"
-        )
+        compressed_name = str(self.backup_dest.joinpath(self._archive_name()))
 
-        if not self.cfg_backups["compress"]:
-            command = [
-                "tar",
-                "-c",
-                "-f",
-                str(compressed_name),
-                "-C",
-                str(self.backup_dest_world),
-                ".",
-            ]
+        pzstd = self._pzstd_command(str(compressed_name))
+        if pzstd:
+            # Pipe tar straight into pzstd, which gives the compressor its own
+            # buffering and writes frames that can be decompressed in parallel
+            tar = subprocess.Popen(
+                [*TAR, "-c", "-C", str(self.backup_dest_world), "."],
+                cwd=str(self.backup_dest),
+                stdout=subprocess.PIPE,
+            )
+            comp = subprocess.Popen(
+                pzstd,
+                cwd=str(self.backup_dest),
+                stdin=tar.stdout,
+                stderr=subprocess.PIPE,
+            )
+            tar.stdout.close()  # type: ignore
+            _, stderr = comp.communicate()
+            if tar.wait() or comp.returncode:
+                click.echo(stderr.decode(errors="replace"), err=True)
+                return False, compressed_name
         else:
-            command = [
-                "tar",
+            command = self._compress_command(compressed_name)
+            if not self._run(command, cwd=self.backup_dest):
+                return False, compressed_name
+
+        if os.path.exists(compressed_name):
+            self.last_archive = compressed_name
+            return True, compressed_name
+        else:
+            return False, compressed_name
+
+    async def compress_backup_async(self):
+        """Same as compress_backup(), without blocking the event loop.
+
+        Always compresses through tar -I, the pzstd pipeline is only used by
+        the blocking version.
+        """
+        if self.incremental:
+            raise click.UsageError("Cannot compress incremental.")
+
+        compressed_name = str(self.backup_dest.joinpath(self._archive_name()))
+        command = self._compress_command(compressed_name)
+        if not await self._run_async(command, cwd=self.backup_dest):
+            return False, compressed_name
+
+        if os.path.exists(compressed_name):
+            self.last_archive = compressed_name
+            return True, compressed_name
+        return False, compressed_name
+
+    async def run_async(self):
+        """Sync the world folder then compress it, for use with backup_many()."""
+        await self.sync_world_folder_async()
+        if self.incremental:
+            return True, None
+        return await self.compress_backup_async()
+
+    def _compress_command(self, compressed_name: str) -> list:
+        """Build the tar command that writes the (compressed) archive."""
+        if not self.cfg_backups["compress"]:
+            return [
+                *TAR,
                 "-c",
-                "-I",
-                f"{self.cfg_backups['compress']}",
                 "-f",
                 str(compressed_name),
                 "-C",
@@ -97,19 +373,123 @@ class BackupManager:
                 ".",
             ]
 
-        subprocess.call(
-            command,
+        return [
+            *TAR,
+            "-c",
+            "-I",
+            f"{self.cfg_backups['compress']}",
+            "-f",
+            str(compressed_name),
+            "-C",
+            str(self.backup_dest_world),
+            ".",
+        ]
+
+    def compress_and_upload(self, bucket: str = "", key: str = "") -> str:
+        """Stream the world through tar and the compressor straight into S3.
+
+        Nothing is written to the local backups folder. boto3 pulls 64MB parts
+        from the compressor's stdout and uploads them while tar is still running.
+
+        Args:
+            bucket (str, optional): Bucket to upload into. Defaults to backups.aws.bucket.
+            key (str, optional): Key of the archive. Defaults to a timestamped backup name.
+
+        Returns:
+            str: The key the archive was uploaded to.
+        """
+        if self.incremental:
+            raise click.UsageError("Cannot compress incremental.")
+
+        bucket = bucket or self._bucket
+        if not bucket:
+            raise click.UsageError("No backups.aws.bucket is defined in config.")
+        key = key or self._subfolder + self._archive_name()
+
+        tar = subprocess.Popen(
+            [*TAR, "-c", "-C", str(self.backup_dest_world), "."],
             cwd=str(self.backup_dest),
-            stderr=subprocess.STDOUT,
+            stdout=subprocess.PIPE,
         )
+        stream = tar.stdout
+        comp = None
 
-        if Path(compressed_name).exists():
-            return True, compressed_name
-        else:
-            return False, compressed_name
+        compress = self._pzstd_command(None) or shlex.split(
+            str(self.cfg_backups["compress"] or ""),
+        )
+        if compress:
+            comp = subprocess.Popen(
+                compress,
+                cwd=str(self.backup_dest),
+                stdin=tar.stdout,
+                stdout=subprocess.PIPE,
+            )
+            tar.stdout.close()  # type: ignore
+            stream = comp.stdout
+
+        click.echo(f"Streaming backup to s3://{bucket}/{key}...")
+        try:
+            self._s3().upload_fileobj(
+                Fileobj=stream,
+                Bucket=bucket,
+                Key=key,
+                ExtraArgs=UPLOAD_ARGS,
+                Config=TRANSFER_CONFIG,
+            )
+        except BaseException:
+            # Nothing reads the pipe any more, don't leave them blocked on it
+            for proc in (comp, tar):
+                if proc is not None:
+                    proc.kill()
+            raise
+        finally:
+            stream.close()  # type: ignore
+            failed = comp.wait() if comp else 0
+            failed = tar.wait() or failed
+
+        if failed:
+            # Don't leave a truncated archive where listing and pruning would
+            # take it for a good backup
+            self._s3().delete_object(Bucket=bucket, Key=key)
+            raise click.ClickException(
+                f"Backup stream failed, removed the incomplete s3://{bucket}/{key}.",
+            )
+        click.echo(f"Uploaded s3://{bucket}/{key}")
+        return key
+
+    def _archive_name(self) -> str:
+        """File name for a new full backup, relative to the backup folder."""
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        return self._name_pattern % f"{self.cfg.get_str('world')}_{timestamp}"
+
+    def _pzstd_command(self, compressed_name: str | None) -> list | None:
+        """Build the pzstd command when the configured compressor is zstd.
+
+        The default keeps --rsyncable, which pzstd does not support, so syncs of
+        the archives stay small. Dropping it from compress picks pzstd instead,
+        trading that for frames that decompress in parallel.
+
+        Returns None if compression is something else, asks for --rsyncable, or
+        pzstd is not installed, so the caller can fall back to tar -I. Without a
+        compressed_name, pzstd writes to stdout.
+        """
+        compress = str(self.cfg_backups["compress"] or "").split()
+        if not compress or Path(compress[0]).name not in ("zstd", "zstdmt"):
+            return None
+        if "--rsyncable" in compress:
+            return None
+
+        pzstd = shutil.which("pzstd")
+        if not pzstd:
+            return None
+
+        command = [pzstd, "-p", str(os.cpu_count() or 1), "-q", "-f"]
+        command += [arg for arg in compress[1:] if arg[1:].isdigit()]
+        command += ["-o", compressed_name] if compressed_name else ["-c"]
+        return command
 
     def git_sync(self, push: bool = False):
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M")
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         command = [
             "git",
             "commit",
@@ -117,22 +497,98 @@ class BackupManager:
             f"Backup at {timestamp}",
         ]
 
-        subprocess.call(
-            command,
-            cwd=str(self.backup_dest_world),
-            stderr=subprocess.STDOUT,
-        )
+        # A backup where nothing changed is fine, but git commit exits 1 for it
+        if self._git_has_changes():
+            self._run(command, cwd=self.backup_dest_world)
+        else:
+            click.echo("Nothing changed since the last backup commit")
 
         if push:
             command = [
                 "git",
                 "push",
             ]
+            self._run(command, cwd=self.backup_dest_world)
+
+    def _git_has_changes(self) -> bool:
+        """Whether git commit -a has anything to commit.
+
+        Anything other than a clean diff, such as a repo with no commits yet,
+        counts as a change so the commit runs and reports it.
+        """
+        return (
             subprocess.call(
-                command,
+                ["git", "diff", "HEAD", "--quiet"],
                 cwd=str(self.backup_dest_world),
-                stderr=subprocess.STDOUT,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            != 0
+        )
+
+    @staticmethod
+    def _run(command: list, cwd=None) -> bool:
+        """Run a command quietly, printing its stderr if it fails.
+
+        Returns:
+            bool: True if the command exited successfully.
+        """
+        try:
+            subprocess.run(
+                command,
+                cwd=str(cwd) if cwd else None,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            click.echo(f"Command failed: {' '.join(command)}", err=True)
+            click.echo(e.stderr.decode(errors="replace"), err=True)
+            return False
+        except OSError as e:
+            click.echo(f"Command failed: {' '.join(command)} ({e})", err=True)
+            return False
+        return True
+
+    @staticmethod
+    async def _run_async(command: list, cwd=None) -> bool:
+        """Async version of _run()."""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *command,
+                cwd=str(cwd) if cwd else None,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
             )
+        except OSError as e:
+            click.echo(f"Command failed: {' '.join(command)} ({e})", err=True)
+            return False
+
+        _, stderr = await proc.communicate()
+        if proc.returncode:
+            click.echo(f"Command failed: {' '.join(command)}", err=True)
+            click.echo(stderr.decode(errors="replace"), err=True)
+            return False
+        return True
+
+    def _list_backups(self):
+        """Yield the backup files under the backup folder, relative to it.
+
+        Walks with os.scandir, which caches the entry type so no extra stat
+        or Path object is needed per file.
+        """
+        base = str(self.backup_dest)
+        prefix_len = len(base) + 1
+        pattern = self._name_re
+
+        stack = [base]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif pattern.match(entry.name):
+                        yield entry.path[prefix_len:]
 
     def aws_sync(self, upload: bool = False, download: bool = False, limit: int = 2):
         """Sync the backups folder with AWS S3
@@ -146,40 +602,29 @@ class BackupManager:
             click.echo("Cannot AWS ship incremental")
             return self
 
-        bucket = self.server.config.tree_str("backups", "aws", "bucket")
-        if not bucket or len(bucket) == 0:
+        bucket = self._bucket
+        if not bucket:
             click.echo("No backups.aws.bucket is defined in config.")
             return
-        subfolder = self.server.config.tree_str("backups", "aws", "subfolder")
-        if len(subfolder):
-            subfolder = f"{subfolder}/"
-
-        # Figure out what files we're going to upload
-        path = Path(self.backup_dest)
-        paths = list()
-
-        for file in path.rglob(self.server.config.tree_str("backups", "name") % "*"):
-            if file.is_dir():
-                continue
-            paths.append(str(file).replace(f"{str(path)}/", ""))
-
-        paths = set(sorted(paths))
+        subfolder = self._subfolder
 
         s3 = self._s3()
-        contents = set()
-        try:
-            objects = s3.list_objects_v2(
-                Bucket=bucket,
-                Prefix=subfolder,
-                EncodingType="url",
-            )["Contents"]
-            if len(objects) > 0:
-                contents = set([obj["Key"].replace(subfolder, "") for obj in objects])
-        except KeyError:
-            pass
+        contents = set(self._list_aws(s3, bucket, subfolder))
 
-        combined = paths.union(contents)
-        valid_files = set(sorted(combined, reverse=True)[0:limit])
+        # Figure out what files we're going to upload
+        path = Path(self.backup_dest)
+        paths = None
+        if self.last_archive and limit == 1:
+            # We just made the newest archive, so there's no need to walk the
+            # folder for it, unless S3 has something that sorts after it
+            newest = os.path.relpath(self.last_archive, path)
+            if newest >= max(contents, default=""):
+                paths = {newest}
+        if paths is None:
+            paths = set(self._list_backups())
+
+        # Names embed a fixed width timestamp, so the largest names are the newest
+        valid_files = set(heapq.nlargest(limit, paths | contents))
 
         to_upload: set
         to_upload = valid_files - contents
@@ -195,23 +640,38 @@ class BackupManager:
 
         # Upload the files if needed
         if upload and to_upload:
-            for sync_path in to_upload:
+
+            def upload_one(sync_path: str):
                 key = subfolder + sync_path
                 local_file = str(path.joinpath(sync_path))
                 click.echo(f"Uploading {local_file}...")
-                s3.upload_file(local_file, Bucket=bucket, Key=key)
+                s3.upload_file(
+                    local_file,
+                    Bucket=bucket,
+                    Key=key,
+                    ExtraArgs=UPLOAD_ARGS,
+                    Config=TRANSFER_CONFIG,
+                )
                 click.echo(f"Uploaded {local_file} to s3://{bucket}/{key}")
+
+            with ThreadPoolExecutor(max_workers=min(len(to_upload), 4)) as pool:
+                # Consume the results so a failed upload raises here
+                list(pool.map(upload_one, to_upload))
         else:
             click.echo(f"Not uploading - {len(to_upload)} potentially (max {limit})")
 
         # Download the files if needed
         if download and to_download:
-            for download_file in to_download:
+
+            def download_one(download_file: str):
                 key = subfolder + download_file
                 local_file = str(path.joinpath(download_file))
                 click.echo(f"Downloading s3://{bucket}/{key}...")
-                s3.download_file(bucket, key, local_file)
+                s3.download_file(bucket, key, local_file, Config=TRANSFER_CONFIG)
                 click.echo(f"Downloaded s3://{bucket}/{key} to {local_file}")
+
+            with ThreadPoolExecutor(max_workers=min(len(to_download), 4)) as pool:
+                list(pool.map(download_one, to_download))
         else:
             click.echo(
                 f"Not downloading - {len(to_download)} potentially (max {limit})",
@@ -220,14 +680,10 @@ class BackupManager:
     def prune_local(self, count: int, yes: bool):
         # Load the list of files
         path = Path(self.backup_dest)
-        paths = list()
-        for file in path.rglob(self.server.config.tree_str("backups", "name") % "*"):
-            if file.is_dir():
-                continue
-            paths.append(str(file).replace(f"{str(path)}/", ""))
 
         contents: list
-        contents = sorted(paths)
+        contents = list(self._list_backups())
+        contents.sort()
         remove = contents[: -count or None]
         keep = contents[-count:]
 
@@ -267,29 +723,15 @@ class BackupManager:
             click.echo("Count must be 1 or more")
             return self
 
-        bucket = self.server.config.tree_str("backups", "aws", "bucket")
-        if not bucket or len(bucket) == 0:
+        bucket = self._bucket
+        if not bucket:
             click.echo("No backups.aws.bucket is defined in config.")
             return
-        subfolder = self.server.config.tree_str("backups", "aws", "subfolder")
-        if len(subfolder):
-            subfolder = f"{subfolder}/"
+        subfolder = self._subfolder
 
         s3 = self._s3()
-        contents = list()
-        try:
-            objects = s3.list_objects_v2(
-                Bucket=bucket,
-                Prefix=subfolder,
-                EncodingType="url",
-            )["Contents"]
-            if len(objects) > 0:
-                for obj in objects:
-                    val = obj["Key"].replace(subfolder, "")
-                    if val:
-                        contents.append(val)
-        except KeyError:
-            pass
+        contents = self._list_aws(s3, bucket, subfolder)
+        contents.sort()
 
         remove = contents[: -count or None]
         keep = contents[-count:]
@@ -312,19 +754,69 @@ class BackupManager:
                 click.echo("Delete rejected.")
                 return self
 
-            for file in remove:
-                s3.delete_object(
+            # delete_objects takes up to 1000 keys per request
+            # Quiet mode only lists the keys that failed, and still returns 200
+            objects = [{"Key": f"{subfolder}{file}"} for file in remove]
+            failed = []
+            while objects:
+                batch, objects = objects[:1000], objects[1000:]
+                resp = s3.delete_objects(
                     Bucket=bucket,
-                    Key=f"{subfolder}{file}",
+                    Delete={"Objects": batch, "Quiet": True},
                 )
-                click.echo(f"Deleted {subfolder}{file}")
+                errors = {e["Key"]: e.get("Code", "") for e in resp.get("Errors", [])}
+                for obj in batch:
+                    if obj["Key"] in errors:
+                        failed.append(f"{obj['Key']} ({errors[obj['Key']]})")
+                    else:
+                        click.echo(f"Deleted {obj['Key']}")
             click.echo()
+
+            if failed:
+                raise click.ClickException(
+                    "Unable to delete: %s" % ", ".join(failed),
+                )
             click.echo("Complete")
         else:
             click.echo("Nothing to delete")
 
         return self
 
+    @staticmethod
+    def _list_aws(s3, bucket: str, subfolder: str) -> list:
+        """List every backup file name under the subfolder in the bucket.
+
+        Uses a paginator, a single list_objects_v2 call stops at 1000 keys.
+        """
+        contents = list()
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=bucket,
+            Prefix=subfolder,
+            EncodingType="url",
+        ):
+            for obj in page.get("Contents", ()):
+                val = obj["Key"].replace(subfolder, "")
+                if val:
+                    contents.append(val)
+        return contents
+
     @staticmethod
     def _print_files(files: list, message: str, max: int = 8) -> str:
         return message + "\n + %s" % "\n + ".join(files[:max])
+
+
+def backup_many(managers: list) -> list:
+    """Back up several worlds at once with one BackupManager each.
+
+    The rsync and tar processes of each manager run concurrently, so one world
+    can be compressing while another is still copying.
+
+    Returns:
+        list: The result of run_async() for each manager, in the same order.
+    """
+
+    async def run_all():
+        return await asyncio.gather(*(m.run_async() for m in managers))
+
+    return asyncio.run(run_all())
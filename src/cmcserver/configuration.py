@@ -1,8 +1,18 @@
+import copy
+import functools
+import hashlib
+import mmap
+import os
+import pickle
+import stat
+import tomllib
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import click
-import tomlkit
-from tomlkit.items import Integer, Item, String, Table
+
+if TYPE_CHECKING:
+    import tomlkit
 
 
 def default_config() -> dict:
@@ -12,12 +22,13 @@ def default_config() -> dict:
             "rcon_port": 25575,
             "rcon_password": "",
             "query_port": 25565,
+            "rcon_pipeline": False,
         },
         "backups": {
             "folder": "/path/to/backups",
             "full": "full",
             "incremental": "incremental",
-            "compress": "/usr/bin/zstd -19 -T2",
+            "compress": "/usr/bin/zstd -T0 -3 --rsyncable",
             "name": "%s.tar.zst",
             "aws": {
                 "bucket": "",
@@ -30,7 +41,7 @@ def default_config() -> dict:
         },
         "mca": {
             "bin": "/path/to/java -jar /path/to/mcaselector",
-            "compress": "/usr/bin/zstd -19 -T2",
+            "compress": "/usr/bin/zstd -19 -T0",
             "name": "%s.tar.zst",
         },
         "startup_script": "/path/to/startup_script.sh",
@@ -42,8 +53,55 @@ def default_config() -> dict:
     }
 
 
-def default_config_toml() -> tomlkit.TOMLDocument:
-    cfg = default_config()
+# Bytes at the start of the config cache that identify the parsed file
+CACHE_HEADER_SIZE = 64
+
+# Config files bigger than this are memory mapped rather than read
+MMAP_THRESHOLD = 4096
+
+# Built once and only read, filled in defaults are copied out of it
+_DEFAULTS = default_config()
+
+
+def _is_private(st: os.stat_result, is_type) -> bool:
+    """Whether a stat is of the expected type, ours, and closed to everyone else."""
+    return is_type(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def _deep_merge(base: dict, over: dict) -> dict:
+    """Merge over onto base, filling in any keys a nested table leaves out.
+
+    Tables are only copied when something has to be filled in, so a complete
+    config file is used as loaded. Defaults that are filled in are copied, so
+    changing the merged config never changes base.
+    """
+    merged = over
+    for key, default in base.items():
+        if key not in over:
+            val = copy.deepcopy(default)
+        elif isinstance(default, dict) and isinstance(over[key], dict):
+            val = _deep_merge(default, over[key])
+            if val is over[key]:
+                continue
+        else:
+            continue
+
+        if merged is over:
+            merged = dict(over)
+        merged[key] = val
+    return merged
+
+
+@functools.lru_cache(maxsize=1)
+def default_config_toml() -> "tomlkit.TOMLDocument":
+    """Build the commented default config document.
+
+    Cached, as it is only ever read. Don't modify the returned document.
+    """
+    # tomlkit is slow to import and only needed to write the config
+    import tomlkit
+
+    cfg = _DEFAULTS
     doc = tomlkit.document()
     doc.add(tomlkit.comment("Configuration for cmcserver command"))
     doc.add(tomlkit.nl())
@@ -90,6 +148,14 @@ def default_config_toml() -> tomlkit.TOMLDocument:
     table.add("rcon_password", cfg["server"]["rcon_password"])
     table.add("rcon_port", cfg["server"]["rcon_port"])
     table.add("query_port", cfg["server"]["query_port"])
+    table.add(
+        "rcon_pipeline",
+        tomlkit.item(cfg["server"]["rcon_pipeline"]).comment(
+            "Send batches of commands without waiting for each reply. "
+            "Keep off for vanilla servers, they read one packet and throw away the rest, "
+            "so the replies never come and the command hangs. Only enable if your server supports it.",
+        ),
+    )
     table["rcon_password"].comment("Password set in server.properties. Make it good.")
     doc.add("server", table)
 
@@ -127,7 +193,11 @@ def default_config_toml() -> tomlkit.TOMLDocument:
     table.add("git", git)
 
     table["folder"].comment("Base path to the backups folder")
-    table["compress"].comment("Command to apply compression to the backups")
+    table["compress"].comment(
+        "Command to apply compression to the backups. -T0 uses all cores, levels 3-10 balance speed and size. "
+        "--rsyncable costs <1% in size but lets syncs only transfer changed blocks. "
+        "Without it, zstd is swapped for pzstd when installed, for archives that decompress in parallel.",
+    )
     table["name"].comment(
         "Syntax of the backup filename. If compression changes, change the extension here.",
     )
@@ -141,18 +211,32 @@ def default_config_toml() -> tomlkit.TOMLDocument:
     mca["bin"].comment(
         "Path to java & executable for mcaselect, eg /blah/java -jar /path/mcaselector.jar",
     )
+    mca["compress"].comment(
+        "Compressor for chunk backups, -T0 uses all cores. Leave blank for a plain tar.",
+    )
     doc.add("mca", mca)
 
     return doc
 
 
+@functools.lru_cache(maxsize=1)
+def default_config_text() -> str:
+    """The default config document as TOML text, rendered once."""
+    import tomlkit
+
+    return tomlkit.dumps(default_config_toml())
+
+
 class Config:
     """Config object parses and holds the config read from file."""
 
     def __init__(self, data: dict, debug) -> None:
-        self.data = default_config() | data
+        self.data = _deep_merge(_DEFAULTS, data)
         self.debug = debug
-        pass
+
+        # Every key path mapped to its value, so tree() is a single lookup
+        self._flat: dict[tuple, object] = {}
+        self._index(self.data, ())
 
     def __str__(self) -> str:
         return str(self.data)
@@ -162,51 +246,34 @@ class Config:
             return self.data[key]
         return None
 
-    def get_int(self, key) -> int:
+    def _get_typed(self, key, expected: type, name: str):
         val = self.get(key)
-        if isinstance(val, int):
+        if isinstance(val, expected):
             return val
-        if isinstance(val, Integer):
-            return int(val)
-        raise TypeError(f"{key} was not a integer (was {type(val)})")
+        raise TypeError(f"{key} was not a {name} (was {type(val)})")
+
+    def get_int(self, key) -> int:
+        return self._get_typed(key, int, "integer")
 
     def get_str(self, key) -> str:
-        val = self.get(key)
-        if isinstance(val, str):
-            return val
-        if isinstance(val, String):
-            return str(val)
-        raise TypeError(f"{key} was not a string (was {type(val)})")
+        return self._get_typed(key, str, "string")
 
     def get_dict(self, key) -> dict:
-        val = self.get(key)
-        if isinstance(val, dict):
-            return val
-        if isinstance(val, Table):
-            return dict(val)
-
-        raise TypeError(f"{key} was not a dict (was {type(val)})")
+        return self._get_typed(key, dict, "dict")
 
-    def tree(self, *keys) -> str | dict | Table | Item | None:
-        val = self.data
-        for key in keys:
-            if isinstance(val, Table) and key in val:
-                val = val[key]
-            elif isinstance(val, dict) and key in val:
-                val = val[key]
-            else:
-                val = None
+    def _index(self, val, keys: tuple) -> None:
+        self._flat[keys] = val
+        if isinstance(val, dict):
+            for key, child in val.items():
+                self._index(child, keys + (key,))
 
-        if isinstance(val, String):
-            return str(val)
-        return val
+    def tree(self, *keys) -> str | int | dict | None:
+        return self._flat.get(keys)  # type: ignore
 
     def tree_str(self, *keys):
         val = self.tree(*keys)
         if isinstance(val, str):
             return val
-        if isinstance(val, String):
-            return str(val)
         if not val:
             return ""
         raise TypeError(f"{'.'.join(keys)} was not a string (was {type(val)})")
@@ -225,38 +292,109 @@ class Config:
             Config: Returns an instance of the Config class
         """
         # Don't create the file if it doesn't exist, make them do it
-        if not config_file.exists():
+        try:
+            config_stat = config_file.stat()
+        except FileNotFoundError:
             click.echo(f"Config is read from: {config_file}")
             click.echo(
                 "Config file does not exist. Please create it or call the --init attribute.",
             )
             raise SystemExit
+        use_cache = not os.environ.get("CMC_NO_CACHE")
+        cache_path = cls.cache_path(config_file)
+
+        # The cache starts with a header naming the exact file version it holds
+        name = hashlib.sha1(str(config_file.resolve()).encode()).hexdigest()[:16]
+        key = f"{name}-{config_stat.st_mtime_ns}-{config_stat.st_size}".encode()
+        header = key.ljust(CACHE_HEADER_SIZE)
+        if use_cache:
+            try:
+                cached = cls._read_cache(cache_path)
+                if cached is not None and cached.startswith(header):
+                    return cls(pickle.loads(cached[CACHE_HEADER_SIZE:]), debug)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+
+        # tomllib is much faster than tomlkit, and we never write this data back.
+        # The file is tiny, so read the raw bytes in one go and parse from memory,
+        # skipping the text layer's newline translation.
+        data = tomllib.loads(cls._read_text(config_file, config_stat.st_size))
+
+        # Cache the parsed data so the next run can skip parsing. The cache holds
+        # the rcon password too, so it is only readable by us.
+        if use_cache:
+            tmp = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+            try:
+                cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+                if _is_private(os.lstat(cache_path.parent), stat.S_ISDIR):
+                    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    with open(fd, mode="wb") as fp:
+                        fp.write(header)
+                        pickle.dump(data, fp)
+                    os.replace(tmp, cache_path)
+            except OSError:
+                tmp.unlink(missing_ok=True)
+
+        return cls(data, debug)
+
+    @staticmethod
+    def _read_text(config_file: Path, size: int) -> str:
+        """Read the config as UTF-8 text.
+
+        Larger files are decoded straight from a memory map of the page cache
+        rather than being copied into a bytes object first.
+        """
+        if size <= MMAP_THRESHOLD:
+            return config_file.read_bytes().decode("utf-8")
 
-        with open(config_file, mode="rt", encoding="utf-8") as fp:
-            data = tomlkit.load(fp)
-            return cls(data, debug)
+        with open(config_file, mode="rb") as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return str(mm, "utf-8")
+
+    @staticmethod
+    def cache_path(config_file: Path) -> Path:
+        """Path of the pickled copy of the parsed config file.
+
+        Kept in the user's cache folder. There is only one, its header says which
+        config file it holds, so loading a different config replaces it.
+        """
+        cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+        return Path(cache_home, "cmcserver", "config.pkl")
+
+    @staticmethod
+    def _read_cache(cache_path: Path) -> bytes | None:
+        """Read the cache, if it and its folder can only have been written by us.
+
+        Unpickling runs code, so anything someone else could have put there is
+        ignored and the config is parsed instead.
+        """
+        if not _is_private(os.lstat(cache_path.parent), stat.S_ISDIR):
+            return None
+
+        fd = os.open(cache_path, os.O_RDONLY | os.O_NOFOLLOW)
+        with open(fd, mode="rb") as fp:
+            if not _is_private(os.fstat(fd), stat.S_ISREG):
+                return None
+            return fp.read()
 
     @classmethod
     def dumps(cls):
-        doc = default_config_toml()
-        return str(tomlkit.dumps(doc))
+        return default_config_text()
 
     @classmethod
     def write(cls, config_file: Path):
         """Create a default config file in the provided path."""
-
-        doc = default_config_toml()
-        click.echo(tomlkit.dumps(doc))
-
-        with open(config_file, mode="wt", encoding="utf-8") as fp:
-            tomlkit.dump(doc, fp)
+        text = default_config_text()
+        click.echo(text)
+        config_file.write_text(text, encoding="utf-8")
 
     def flatten(self):
+        data = []
+
         def process(collection, prefix=""):
-            data = []
             for key, settings in collection:
-                if isinstance(settings, dict) or isinstance(settings, Table):
-                    data = data + process(settings.items(), prefix=f"{prefix}{key}.")
+                if isinstance(settings, dict):
+                    process(settings.items(), prefix=f"{prefix}{key}.")
                 elif isinstance(settings, bool):
                     data.append((f"{prefix}{key}:", "True" if settings else "False"))
                 elif not settings and not isinstance(settings, int):
@@ -264,13 +402,10 @@ class Config:
                 elif "password" in key:
                     data.append((f"{prefix}{key}:", "*****"))
                 else:
-                    data.append((f"{prefix}{key}:", settings))
-            return data
-
-        data = process(self.data.items())
-        width = max([len(prefix) for prefix, x in data]) + 2
-        data_list = [
-            ("{:<" + str(width) + "}{}").format(key, setting) for key, setting in data
-        ]
+                    data.append((f"{prefix}{key}:", str(settings)))
+
+        process(self.data.items())
+        width = max(len(key) for key, _ in data) + 2
+        data_list = [key.ljust(width) + setting for key, setting in data]
         data_list.sort()
         return "\n".join(data_list)
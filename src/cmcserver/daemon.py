@@ -0,0 +1,246 @@
+import json
+import os
+import select
+import socket
+import stat
+import struct
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Sequence
+
+import click
+
+if TYPE_CHECKING:
+    from .server import ServerManager
+
+# Every message is a 4 byte big endian length followed by that much JSON
+HEADER = struct.Struct(">I")
+
+# pid, uid and gid of a unix socket's peer
+PEERCRED = struct.Struct("3i")
+
+# Seconds without a request before the daemon logs out and exits
+IDLE_TIMEOUT = 60
+
+
+def socket_path() -> Path:
+    """Where the daemon listens, private to the current user."""
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return Path(runtime, "cmcserver.sock")
+    # The temp folder is shared, so the socket goes in a folder only we can open
+    return Path(tempfile.gettempdir(), f"cmcserver-{os.getuid()}", "cmcserver.sock")
+
+
+def _private_dir(folder: Path) -> None:
+    """Create the socket's folder, or check an existing one is only ours."""
+    try:
+        folder.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+
+    st = os.lstat(folder)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise click.ClickException(
+            f"{folder} must be a folder that only you can access",
+        )
+
+
+def _remove_stale(path: Path) -> None:
+    """Remove a socket left by an earlier daemon, but nothing else."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise click.ClickException(f"{path} exists and isn't a daemon socket of yours")
+    path.unlink()
+
+
+def _peer_uid(sock: socket.socket, path: Path) -> int:
+    """User on the other end of the socket, from the kernel where it can say."""
+    if hasattr(socket, "SO_PEERCRED"):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size)
+        return PEERCRED.unpack(creds)[1]
+    return os.stat(path).st_uid
+
+
+def write_message(sock: socket.socket, message: dict) -> None:
+    payload = json.dumps(message).encode()
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def _read_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def read_message(sock: socket.socket) -> dict:
+    (size,) = HEADER.unpack(_read_exact(sock, HEADER.size))
+    return json.loads(_read_exact(sock, size))
+
+
+def send(endpoint: str, commands: Sequence[str]) -> Optional[list]:
+    """Run the commands through a running daemon.
+
+    Args:
+        endpoint (str): host:port of the server the commands are for.
+        commands (Sequence[str]): RCON commands to run.
+
+    Raises:
+        click.ClickException: The request reached the daemon but failed in a way
+        that may have run some of the commands, so they mustn't be sent again.
+
+    Returns:
+        Optional[list]: The responses in order, or None if no daemon could
+        run them and the caller should connect itself.
+    """
+    path = socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(60)
+        sock.connect(str(path))
+        uid = _peer_uid(sock, path)
+    except OSError:
+        sock.close()
+        return None
+
+    if uid != os.getuid():
+        # Someone else is listening there, don't hand them the commands
+        sock.close()
+        click.echo(f"Ignoring {path}, it belongs to another user", err=True)
+        return None
+
+    with sock:
+        try:
+            write_message(sock, {"server": endpoint, "commands": list(commands)})
+            reply = read_message(sock)
+        except (OSError, ValueError) as e:
+            raise click.ClickException(
+                f"Lost the rcon daemon mid request, the commands may have run: {e}",
+            )
+
+    if "responses" in reply:
+        return reply["responses"]
+    if reply.get("sent", True):
+        raise click.ClickException(
+            f"The rcon daemon failed after sending the commands: {reply.get('error')}",
+        )
+    # Turned away before anything was sent, safe to connect ourselves
+    return None
+
+
+class RconDaemon:
+    """Holds one RCON login open and runs commands for other cmcserver calls."""
+
+    def __init__(
+        self,
+        server: "ServerManager",
+        path: Optional[Path] = None,
+        idle_timeout: Optional[float] = IDLE_TIMEOUT,
+    ) -> None:
+        self.server = server
+        self.path = path or socket_path()
+        self.endpoint = server.endpoint()
+        # None or 0 keeps it running until it's stopped
+        self.idle_timeout = idle_timeout or None
+
+    def handle(self, conn: socket.socket) -> None:
+        request = read_message(conn)
+        if request.get("server") != self.endpoint:
+            write_message(
+                conn,
+                {"error": f"Connected to {self.endpoint}", "sent": False},
+            )
+            return
+
+        # Only logging in is retried, once anything is written the server may
+        # have run it, and a repeated /stop or /kick is worse than an error
+        errors = self.server.connection_errors()
+        try:
+            self._login()
+        except errors as e:
+            write_message(
+                conn,
+                {"error": str(e) or "Connection refused", "sent": False},
+            )
+            return
+
+        commands = request.get("commands") or []
+        try:
+            responses = [r for _, r in self.server._raw_send(commands)]
+        except errors as e:
+            self.server.close()
+            write_message(conn, {"error": str(e) or "Connection lost", "sent": True})
+            return
+
+        write_message(conn, {"responses": responses})
+
+    def _login(self) -> None:
+        """Make sure there's a live login, logging in again once if needed."""
+        client = self.server.client
+        if client is not None and self._dropped(client.proto.sock):
+            # The server may have restarted since the last request
+            self.server.close()
+
+        try:
+            self.server._get_client()
+        except self.server.connection_errors():
+            self.server.close()
+            self.server._get_client()
+
+    @staticmethod
+    def _dropped(sock: socket.socket) -> bool:
+        """An idle RCON socket only turns readable once the server closes it."""
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def serve_forever(self) -> None:
+        # Connect up front, so a bad password fails now rather than later
+        self.server._get_client()
+
+        _private_dir(self.path.parent)
+        _remove_stale(self.path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            # Only the current user may talk to the socket
+            umask = os.umask(0o177)
+            try:
+                listener.bind(str(self.path))
+            finally:
+                os.umask(umask)
+            listener.listen()
+            listener.settimeout(self.idle_timeout)
+            click.echo(f"Listening on {self.path} for {self.endpoint}")
+
+            try:
+                while True:
+                    try:
+                        conn, _ = listener.accept()
+                    except TimeoutError:
+                        click.echo(f"No requests for {self.idle_timeout} seconds")
+                        break
+                    with conn:
+                        # A stuck client shouldn't hold up everyone else
+                        conn.settimeout(60)
+                        try:
+                            self.handle(conn)
+                        except (OSError, ValueError) as e:
+                            click.echo(f"Bad request: {e}", err=True)
+                        except self.server.connection_errors() as e:
+                            # Lost the server mid reply, log in again next time
+                            self.server.close()
+                            click.echo(f"RCON error: {e}", err=True)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.path.unlink(missing_ok=True)
+                self.server.close()
@@ -1,44 +1,141 @@
+import functools
 import os
 import pathlib
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from shutil import get_terminal_size
+from typing import TYPE_CHECKING
 
 import click
 
-from .backup import BackupManager
 from .configuration import Config
-from .mca import MCAManager
-from .mca import factory as mfactory
-from .server import ServerManager
+
+if TYPE_CHECKING:
+    from .mca import MCAManager
+    from .server import ServerManager
+
+
+@functools.lru_cache(maxsize=8)
+def _load_cached(path: str, mtime_ns: int, debug: bool) -> Config:
+    """Load a config once per process, until the file changes."""
+    return Config.load(Path(path), debug)
 
 
 class ToolLoader:
-    """Middleman just to make the communicator and config available to commands."""
+    """Middleman just to make the communicator and config available to commands.
+
+    The config is only read when a command first asks for it, so group help and
+    commands that don't need it skip loading it.
+    """
 
-    config: Config
-    server: ServerManager
     config_path: str
-    mca_world: MCAManager
+    mca_world: "MCAManager"
 
     def __init__(self, config_path) -> None:
         self.config_path = config_path
+        self.debug = False
+
+    def setup(self, debug: bool):
+        self.debug = debug
+
+    @functools.cached_property
+    def config(self) -> Config:
+        if not self.config_path:
+            raise click.UsageError("No config file was defined")
+
+        path = Path(self.config_path)
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            # Let load() explain what's missing
+            return Config.load(path, self.debug)
+        return _load_cached(str(path), mtime_ns, self.debug)
+
+    @functools.cached_property
+    def server(self) -> "ServerManager":
+        from .server import ServerManager
 
-    def setup(self, config: Config):
-        self.config = config
-        self.server = ServerManager(self.config)
+        return ServerManager(self.config)
 
     def init_mca(self, world: str):
-        self.mca_world = mfactory(world, self.config)
+        from .mca import factory
 
+        self.mca_world = factory(world, self.config)
+
+    def close(self):
+        """Tear down anything opened during the command."""
+        if "server" in self.__dict__:
+            self.server.close()
+
+
+# Commands that work on the config file itself rather than the loaded config
+_SKIP_SETUP = frozenset(("config", "readme"))
 
 pass_loader = click.make_pass_decorator(ToolLoader, ensure=True)
 
 
+_terminal_columns = None
+
+
+def _forget_terminal_size(*args) -> None:
+    global _terminal_columns
+    _terminal_columns = None
+
+
+def _terminal_width() -> int:
+    """Terminal width, asked once and forgotten again when the window resizes."""
+    global _terminal_columns
+    if _terminal_columns is None:
+        _terminal_columns = get_terminal_size().columns
+    return _terminal_columns
+
+
+def _watch_terminal_size() -> None:
+    """Forget the width when the window resizes, for interactive runs only.
+
+    Done from the CLI rather than at import, so importing the module never
+    replaces a handler the host process set, or fails off the main thread.
+    """
+    if (
+        hasattr(signal, "SIGWINCH")
+        and sys.stdout.isatty()
+        and threading.current_thread() is threading.main_thread()
+    ):
+        signal.signal(signal.SIGWINCH, _forget_terminal_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _short_help(command: click.Command, limit: int) -> str:
+    """Click works the short help out from the docstring on every call."""
+    return command.get_short_help_str(limit)
+
+
+def _row_name(row: tuple[str, click.Command]) -> str:
+    return row[0]
+
+
 class DetailedGroup(click.Group):
     """Override the default click help so it can actually show a wider width."""
 
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._help_cache: dict[tuple, str] = {}
+
+    def get_help(self, ctx: click.Context) -> str:
+        # The help only changes with where the group sits and the terminal width
+        key = (ctx.command_path, _terminal_width())
+        if key not in self._help_cache:
+            self._help_cache[key] = super().get_help(ctx)
+        return self._help_cache[key]
+
     def format_help(self, ctx, formatter):
-        formatter.width = get_terminal_size().columns
+        formatter.width = _terminal_width()
         super().format_help(ctx, formatter)
 
     def format_commands(
@@ -46,22 +143,24 @@ class DetailedGroup(click.Group):
         ctx: click.Context,
         formatter: click.HelpFormatter,
     ) -> None:
-        def command_tree(items, prefix: str = ""):
-            rows = {prefix: []}
+        # Walk the groups depth first, nested groups get their own heading
+        groups = {}
+        stack = [("", ctx.command.commands.items())]  # type: ignore
+        while stack:
+            prefix, items = stack.pop()
+            rows = groups.setdefault(prefix, [])
+            nested = []
             for c_name, command in items:
                 if isinstance(command, click.Group):
-                    rows = rows | command_tree(
-                        command.commands.items(),
-                        f"{prefix} {c_name}".strip(),
+                    nested.append(
+                        (f"{prefix} {c_name}".strip(), command.commands.items()),
                     )
                 if isinstance(command, click.Command) and not command.hidden:
                     # Single instance
-                    rows[prefix].append((f"{c_name}".strip(), command))
-            return rows
-
-        groups = command_tree(ctx.command.commands.items())  # type: ignore
+                    rows.append((c_name, command))
+            stack.extend(reversed(nested))
         if len(groups):
-            limit = get_terminal_size().columns
+            limit = _terminal_width()
 
             formatter.write_paragraph()
 
@@ -70,12 +169,13 @@ class DetailedGroup(click.Group):
                     formatter.write_heading(group)
                     formatter.indent()
 
-                rows = []
-                for subcommand, cmd in commands:
-                    help = cmd.get_short_help_str(limit)
-                    rows.append((subcommand, help))
-                rows.sort()
-                formatter.write_dl(rows)
+                # Groups keep the order they were walked, rows go in name order
+                formatter.write_dl(
+                    [
+                        (subcommand, _short_help(cmd, limit))
+                        for subcommand, cmd in sorted(commands, key=_row_name)
+                    ],
+                )
                 formatter.write_paragraph()
                 if len(group):
                     formatter.dedent()
@@ -98,6 +198,7 @@ class DetailedGroup(click.Group):
 def cli(ctx: click.Context, debug, config):
     """Group all of our commands together"""
     ctx.ensure_object(dict)
+    _watch_terminal_size()
 
     config_path = ""
     if config:
@@ -107,18 +208,16 @@ def cli(ctx: click.Context, debug, config):
         config_path = Path(click.get_app_dir("cmcserver.toml"))
 
     ctx.obj = ToolLoader(config_path)
+    ctx.call_on_close(ctx.obj.close)
 
-    if ctx.invoked_subcommand in ("config", "readme"):
+    if ctx.invoked_subcommand in _SKIP_SETUP:
         return
 
     if ctx.invoked_subcommand is None:
         click.echo(ctx.get_help())
         ctx.exit()
 
-    if not config_path:
-        raise click.UsageError("No config file was defined")
-
-    ctx.obj.setup(Config.load(config_path, debug))
+    ctx.obj.setup(debug)
 
 
 ### SERVER COMMANDS
@@ -182,9 +281,14 @@ def ping(loader: ToolLoader):
 @pass_loader
 def restart(loader: ToolLoader, time: int, reason: str):
     """Restart the server"""
+    # The reason goes out together with the first countdown message
+    batch = []
     if reason:
-        loader.server.tell_all(f"Server will be restarting shortly for {reason}")
-    loader.server.stop(time, "restarting")
+        loader.server.tell_all(
+            f"Server will be restarting shortly for {reason}",
+            batch=batch,
+        )
+    loader.server.stop(time, "restarting", batch)
     loader.server.start()
 
 
@@ -196,6 +300,22 @@ def say(loader: ToolLoader, message: str):
     loader.server.tell_all(message)
 
 
+@cli.command(name="rcon-daemon")
+@click.option(
+    "--idle",
+    type=int,
+    default=60,
+    show_default=True,
+    help="Exit after this many seconds without a request, 0 to run until stopped",
+)
+@pass_loader
+def rcon_daemon(loader: ToolLoader, idle: int):
+    """Keep an RCON login open for other commands to share, until idle"""
+    from .daemon import RconDaemon
+
+    RconDaemon(loader.server, idle_timeout=idle).serve_forever()
+
+
 ### BACKUP COMMANDS
 @cli.group(invoke_without_command=True, cls=DetailedGroup)
 @click.pass_context
@@ -219,18 +339,32 @@ def backup(ctx):
     default=False,
     help="Pushes the backup up to the remote storage.",
 )
+@click.option(
+    "--stream",
+    is_flag=True,
+    default=False,
+    help="Compress the full backup straight into AWS without keeping a local copy.",
+)
 @pass_loader
-def base_backup(loader: ToolLoader, incremental: bool, sync: bool):
+def base_backup(loader: ToolLoader, incremental: bool, sync: bool, stream: bool):
     """Create either a full or incremental backup"""
     server = loader.server
 
+    if stream and incremental:
+        raise click.UsageError("Cannot stream an incremental backup.")
+
+    # boto3 is slow to import, so only backup commands load it
+    from .backup import BackupManager
+
     backup_manager = BackupManager(server=server, incremental=incremental)
 
-    # Tell people the backup is happening
-    server.tell_all("Saving the world...", play_sound=False)
+    # Tell people the backup is happening while the sync gets going
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        told = executor.submit(server.tell_all, "Saving the world...", play_sound=False)
 
-    # Sync the content across
-    backup_manager.sync_world_folder()
+        # Sync the content across
+        backup_manager.sync_world_folder()
+        told.result()
 
     if incremental:
         if sync:
@@ -240,6 +374,12 @@ def base_backup(loader: ToolLoader, incremental: bool, sync: bool):
         server.tell_all("Save complete", play_sound=False)
         return
 
+    if stream:
+        backup_manager.compress_and_upload()
+        server.tell_all("Save complete", play_sound=False)
+        click.echo("Sync complete")
+        return
+
     # Compress the full backup
     success, file = backup_manager.compress_backup()
     cfile = click.format_filename(file)
@@ -291,6 +431,8 @@ def aws(ctx):
 @pass_loader
 def sync_backup_aws(loader: ToolLoader, download: bool, upload: bool, limit: int):
     """Upload and download full backup files to a configured AWS S3 bucket"""
+    from .backup import BackupManager
+
     backup_manager = BackupManager(server=loader.server, incremental=False)
 
     backup_manager.aws_sync(upload=upload, download=download, limit=limit)
@@ -312,6 +454,8 @@ def sync_backup_aws(loader: ToolLoader, download: bool, upload: bool, limit: int
 @pass_loader
 def prune_aws(loader: ToolLoader, keep: int, yes: bool):
     """Delete excess backup files from a configured AWS S3 bucket"""
+    from .backup import BackupManager
+
     backup_manager = BackupManager(server=loader.server, incremental=False)
     backup_manager.prune_aws(keep, yes)
 
@@ -327,6 +471,8 @@ def prune_aws(loader: ToolLoader, keep: int, yes: bool):
 @pass_loader
 def sync_backup_git(loader: ToolLoader, push: bool):
     """Upload incremental changes to git"""
+    from .backup import BackupManager
+
     backup_manager = BackupManager(server=loader.server, incremental=True)
     backup_manager.git_sync()
 
@@ -347,6 +493,8 @@ def sync_backup_git(loader: ToolLoader, push: bool):
 @pass_loader
 def prune_local(loader: ToolLoader, keep: int, yes: bool):
     """Prune the backups in the local system"""
+    from .backup import BackupManager
+
     backup_manager = BackupManager(server=loader.server, incremental=False)
     backup_manager.prune_local(keep, yes)
     click.echo("Prune complete")
@@ -420,14 +568,18 @@ def config(
 ):
     """Edit the configuration file, or generate it if it does not exist"""
 
-    config_file = Path(config or loader.config_path)
-    config_file_str = click.format_filename(config_file)
-
     if default:
         click.echo(Config.dumps())
         return
 
-    exists = config_file.exists()
+    config_file = Path(config or loader.config_path)
+    config_file_str = click.format_filename(config_file)
+
+    try:
+        os.stat(config_file)
+        exists = True
+    except FileNotFoundError:
+        exists = False
 
     if path:
         click.echo(config_file_str)
@@ -443,6 +595,7 @@ def config(
             return
 
     if edit:
+        _load_cached.cache_clear()
         click.edit(
             filename=loader.config_path,
             extension=".toml",
@@ -450,7 +603,9 @@ def config(
         return
 
     if delete:
+        _load_cached.cache_clear()
         config_file.unlink()
+        Config.cache_path(config_file).unlink(missing_ok=True)
         click.echo("Deleted the config file")
         return
 
@@ -461,6 +616,18 @@ def config(
         click.echo(cfg.flatten())
 
 
+# Marker comments in the readme, mapped to their block and whether they open it
+README_MARKERS = {
+    "# (config-start)": ("config", True),
+    "# (config-end)": ("config", False),
+    "# (command-start)": ("command", True),
+    "# (command-end)": ("command", False),
+}
+
+# Markers can be anywhere in the line, with text either side
+README_MARKER = re.compile("|".join(map(re.escape, README_MARKERS)))
+
+
 @cli.command(
     name="readme",
     help="Update the readme with the config & commands",
@@ -479,39 +646,49 @@ def config(
 )
 @click.pass_context
 def write_readme_config(ctx: click.Context, readme: pathlib.Path):
-    content = Config.dumps().splitlines()
-    to_write = []
-    with open(readme) as f:
-        in_config = False
-        in_commands = False
-        for line in f:
-            if "# (config-start)" in line:
-                in_config = True
-                to_write.append(line)
-                to_write.append("```\n")
-                to_write.append("\n".join(content))
-                continue
-            elif "# (config-end)" in line:
-                in_config = False
-                to_write.append("\n```\n")
-                to_write.append(line)
-                continue
-            elif "# (command-start)" in line:
-                in_commands = True
-                to_write.append(line)
-                to_write.append("```\n")
-                to_write.append(ctx.find_root().get_help())
-                continue
-            elif "# (command-end)" in line:
-                in_commands = False
-                to_write.append("\n```\n")
-                to_write.append(line)
-                continue
-
-            if not in_config and not in_commands:
-                to_write.append(line)
-    with open(readme, "w") as f:
-        f.write("".join(to_write))
+    blocks = {
+        "config": Config.dumps().removesuffix("\n"),
+        "command": ctx.find_root().get_help(),
+    }
+
+    # Write next to the readme and swap it in, so a failure can't leave it half done
+    # newline="" passes line endings through as they are in the readme
+    out = tempfile.NamedTemporaryFile(
+        "w",
+        encoding="utf-8",
+        newline="",
+        dir=readme.parent,
+        prefix=f".{readme.name}.",
+        delete=False,
+    )
+    try:
+        with out, readme.open(encoding="utf-8", newline="") as f:
+            replacing = False
+            for line in f:
+                found = README_MARKER.search(line)
+                if found is None:
+                    # Lines inside a generated block are dropped and rewritten
+                    if not replacing:
+                        out.write(line)
+                    continue
+
+                # Written lines end the same way as the marker line does
+                eol = line.removeprefix(line.rstrip("\r\n")) or "\n"
+                block, replacing = README_MARKERS[found.group()]
+                if replacing:
+                    out.write(line)
+                    out.write("```" + eol)
+                    out.write(blocks[block].replace("\n", eol))
+                else:
+                    out.write(eol + "```" + eol)
+                    out.write(line)
+
+        shutil.copymode(readme, out.name)
+        os.replace(out.name, readme)
+    except BaseException:
+        # Don't leave the half written copy next to the readme
+        os.unlink(out.name)
+        raise
     click.echo("Readme has been updated")
 
 
@@ -1,5 +1,7 @@
+import shlex
 import shutil
 import subprocess
+import tarfile
 from datetime import datetime
 from pathlib import Path
 
@@ -8,21 +10,24 @@ import click
 from .configuration import Config
 
 
-def factory(world: str, config: Config):
-    world = world.title().replace("-", "")
-    cls = globals()[f"MCA{world}"]
-    return cls(config)
-
-
 class MCAManager:
     def __init__(self, config: Config) -> None:
         self.config = config
 
+        # None of these change during a command, so work them out once
+        self._world_path = self._world()
+        self._name = self._fname()
+        self._output_path = self._output()
+        self._dir_path = self._dir()
+
+        # Split like a shell would, so quoted paths with spaces stay whole
+        self._base_argv = tuple(shlex.split(self.config.tree_str("mca", "bin")))
+
     def title(self):
         raise NotImplementedError("Must implement title()")
 
     def folder(self):
-        return str(self._world())
+        return str(self._world_path)
 
     def _query(self) -> str:
         raise NotImplementedError("Must implement _query()")
@@ -31,22 +36,21 @@ class MCAManager:
         raise NotImplementedError("Must implement _world()")
 
     def _region(self) -> Path:
-        return self._world().joinpath("")
+        return self._world_path.joinpath("")
 
     def _fname(self) -> str:
         return self.title().replace(" ", "-").lower()
 
     def _output(self) -> Path:
-        return Path("chunks-{}.csv".format(self._fname()))
+        return Path("chunks-{}.csv".format(self._name))
 
     def _dir(self) -> Path:
-        return Path("chunks-{}".format(self._fname()))
+        return Path("chunks-{}".format(self._name))
 
     def _run(self, debug: bool, mode: str, *args):
-        world = str(self._world().absolute())
-        base = str(Path(self.config.tree_str("mca", "bin")))
+        world = str(self._world_path.absolute())
 
-        command = [*base.split(" "), "--world", world, "--mode", mode, *args]
+        command = [*self._base_argv, "--world", world, "--mode", mode, *args]
 
         if debug:
             # click.echo(f"Command: {' '.join(command)}")
@@ -65,7 +69,7 @@ class MCAManager:
             return
 
         # Output, where we write things
-        output = str(self._output().absolute())
+        output = str(self._output_path.absolute())
 
         code = self._run(debug, "select", "--query", query, "--output", output)
 
@@ -76,7 +80,7 @@ class MCAManager:
         click.echo("Output has been written to {}".format(output))
 
     def delete(self, debug: bool):
-        output = self._output()
+        output = self._output_path
         if not output.exists():
             raise click.UsageError(
                 "Chunks CSV file wasn't there, run the select command first.",
@@ -92,21 +96,22 @@ class MCAManager:
             return
 
         click.echo("Chunks have been removed")
-        self._output().unlink(missing_ok=True)
+        self._output_path.unlink(missing_ok=True)
 
     def backup(self, debug: bool):
         #  Output Folder
-        dir = self._dir()
-        if dir.exists():
-            shutil.rmtree(dir)
+        dir = self._dir_path
+        shutil.rmtree(dir, ignore_errors=True)
 
-        dir.mkdir(parents=False)
-        if not dir.exists():
+        # mkdir raises if it couldn't make the folder, no need to check after
+        try:
+            dir.mkdir(parents=False)
+        except OSError:
             raise click.UsageError(
                 "Unable to write to temporary directory {}".format(dir.absolute()),
             )
 
-        output = self._output()
+        output = self._output_path
         if not output.exists():
             raise click.UsageError(
                 "Chunks CSV file wasn't there, run the select command first.",
@@ -129,48 +134,43 @@ class MCAManager:
 
         # Compress the chunks
         timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-        compressed_name = cfg["name"] % f"{self._fname()}_{timestamp}"
-
-        if not cfg["compress"]:
-            compress_command = [
-                "tar",
-                "-c",
-                "-f",
-                str(compressed_name),
-                "-C",
-                str(dir.absolute()),
-                ".",
-            ]
-        else:
-            compress_command = [
-                "tar",
-                "-c",
-                "-I",
-                f"{cfg['compress']}",
-                "-f",
-                str(compressed_name),
-                "-C",
-                str(dir.absolute()),
-                ".",
-            ]
+        compressed_name = cfg["name"] % f"{self._name}_{timestamp}"
+
+        compress = ["-I", cfg["compress"]] if cfg["compress"] else []
+        compress_command = [
+            "tar",
+            "-c",
+            *compress,
+            "-f",
+            str(compressed_name),
+            "-C",
+            str(dir.absolute()),
+            ".",
+        ]
 
         if debug:
             print(compress_command)
             return
 
         click.echo("Compressing files")
-        subprocess.call(
-            compress_command,
-            stderr=subprocess.STDOUT,
-        )
+        if compress:
+            code = subprocess.call(
+                compress_command,
+                stderr=subprocess.STDOUT,
+            )
+        else:
+            # Nothing to pipe through, so write the tar without forking
+            with tarfile.open(compressed_name, "w") as tar:
+                tar.add(dir, arcname=".")
+            code = 0
 
-        if Path(compressed_name).exists():
+        # A failed compressor can still leave a partial archive behind
+        if not code and Path(compressed_name).exists():
             click.echo("Backed up to {}".format(compressed_name))
         else:
             click.echo("Failed to compress")
 
-        if dir.exists():
-            shutil.rmtree(dir)
+        shutil.rmtree(dir, ignore_errors=True)
 
 
 class MCAOverworld(MCAManager):
@@ -234,3 +234,15 @@ class MCAOverworldPurge(MCAManager):
         return Path(self.config.get_str("game_folder")).joinpath(
             Path(self.config.get_str("world")),
         )
+
+
+# The --world choices, mapped to the manager for that world
+_REGISTRY = {
+    "overworld": MCAOverworld,
+    "end": MCAEnd,
+    "overworld-purge": MCAOverworldPurge,
+}
+
+
+def factory(world: str, config: Config) -> MCAManager:
+    return _REGISTRY[world.lower()](config)
@@ -1,14 +1,29 @@
+import bisect
+import contextlib
+import functools
+import getpass
 import json
-import math
+import operator
+import os
+import re
+import select
+import socket
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from os import SEEK_END
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 import click
-from mctools import RCONClient
 
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # pragma: no cover - optional, Linux only
+    INotify = None
+
+from . import daemon
 from .configuration import Config
 
 
@@ -25,9 +40,64 @@ def text_prefix(code: str = "SERVER") -> list:
     ]
 
 
+# The default prefix as JSON, without the closing ] so messages can be appended
+PREFIX_JSON = json.dumps(text_prefix(), separators=(",", ":"))[:-1]
+PREFIX_TEXT = "".join(part["text"] for part in text_prefix())
+
+
+# How long, in seconds, a screen -list answer is reused for
+SCREEN_TTL = 0.5
+
+
+# Printable ASCII that json.dumps would leave alone, so no quotes or backslashes
+JSON_SAFE = re.compile(r"[ !#-\[\]-~]*")
+
+
+def _format_tellraw(text: str, color: str, italic: bool) -> str:
+    """JSON text component for a plain message."""
+    flag = "true" if italic else "false"
+    if JSON_SAFE.fullmatch(text) and JSON_SAFE.fullmatch(color):
+        # Countdowns and most messages need no escaping, skip the encoder
+        return f'{{"text":"{text}","color":"{color}","italic":{flag}}}'
+    return '{"text":%s,"color":%s,"italic":%s}' % (
+        json.dumps(text),
+        json.dumps(color),
+        flag,
+    )
+
+
+DEFAULT_SOUND = "block.amethyst_block.resonate"
+
+
+@functools.lru_cache(maxsize=None)
+def _build_playsound(sound: str) -> str:
+    return f"/playsound minecraft:{sound} master @a 0 0 0 10 0.6 1"
+
+
+# Seconds to wait on RCON, pings give up quickly so retry loops keep moving
+RCON_TIMEOUT = 60
+PING_TIMEOUT = 2
+
+# How long, in seconds, a successful ping is trusted for
+PING_TTL = 2
+
+# Where screen keeps its sockets when SCREENDIR isn't set, and their names
+SCREEN_DIRS = ("/run/screen", "/var/run/screen")
+SCREEN_SOCKET = re.compile(r"^\d+\.mcs$")
+
+# Seconds start() keeps checking for the server to come up
+START_TIMEOUT = 100
+
+# Seconds of silence from the log before _follow gives up on it
+FOLLOW_TIMEOUT = 50
+
+# When to announce a countdown, largest first
+COUNTDOWN_STEPS = (600, 300, 180, 120, 60, 30, 10, 5)
+
+
 def seconds_to_countdown(
     seconds: int,
-    seconds_range: Optional[List[int]] = None,
+    seconds_range: Optional[Sequence[int]] = None,
 ) -> list:
     # Be given a range of seconds, then break it down
     # into call points, and how long to wait in between each
@@ -36,115 +106,273 @@ def seconds_to_countdown(
         seconds = 10
 
     if seconds_range is None:
-        seconds_range = [600, 300, 180, 120, 60, 30, 10, 5]
-
-    countdown = []
-
-    # Find our range
-    t_range = []
-    for step in seconds_range:
-        if seconds >= step:
-            t_range.append(step)
-
-    upper: int = max(t_range)
-    if seconds > upper:
-        t_range.insert(0, seconds)
+        seconds_range = COUNTDOWN_STEPS
+    else:
+        # The bisect below needs largest first, only the default is known to be
+        seconds_range = sorted(seconds_range, reverse=True)
+
+    # Find our range, the steps are sorted largest first so the ones that fit
+    # are everything from the first step at or under our seconds
+    start = bisect.bisect_left(seconds_range, -seconds, key=operator.neg)
+    t_range = seconds_range[start:]
+    if seconds > t_range[0]:
+        t_range = [seconds, *t_range]
 
     # Now build our actual call object
-    last = max(t_range)
+    countdown = []
+    last = t_range[0]
     for step in t_range:
         countdown.append((last - step, seconds_to_time_text(step)))
         last = step
 
-    last_r = countdown.pop()
-    countdown.append((last_r[0], None))
+    countdown[-1] = (countdown[-1][0], None)
 
     return countdown
 
 
+@functools.lru_cache(maxsize=64)
 def seconds_to_time_text(seconds: int) -> str:
-    t_mins = math.floor(seconds / 60)
-    t_seconds = seconds % 60
-
-    if t_mins == 1 and t_seconds:
-        return f"{t_mins} minute and {t_seconds} seconds"
-    if t_mins and t_seconds:
-        return f"{t_mins} minutes and {t_seconds} seconds"
-    if t_mins and t_mins == 1:
-        return f"{t_mins} minute"
-    if t_mins:
-        return f"{t_mins} minutes"
-    if t_seconds > 9:
-        return f"{t_seconds} seconds"
-    return f"{t_seconds}"
+    t_mins, t_seconds = divmod(seconds, 60)
+
+    # Under a minute is the usual case, it's every tick of the final countdown
+    if not t_mins:
+        return f"{t_seconds} seconds" if t_seconds > 9 else f"{t_seconds}"
+
+    minutes = "minute" if t_mins == 1 else "minutes"
+    if t_seconds:
+        return f"{t_mins} {minutes} and {t_seconds} seconds"
+    return f"{t_mins} {minutes}"
+
+
+@functools.lru_cache(maxsize=4)
+def _resolve(host: str) -> str:
+    """IPv4 address for the RCON host, looked up once rather than per connect.
+
+    mctools only opens IPv4 sockets, so that's all that gets asked for.
+    """
+    try:
+        addresses = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)
+    except socket.gaierror:
+        # Let the connect fail and report it
+        return host
+    return addresses[0][4][0]
+
+
+def _pid_alive(pid: int) -> bool:
+    """Signal 0 checks the process is there without touching it."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Owned by someone else, so not our session any more
+        return False
+    return True
 
 
 class ServerManager:
     def __init__(self, config: Config) -> None:
         self.config = config
         self.debug = self.config.debug
+        # The server details never change during a run, so look them up once
+        srv = self.config.data["server"]
+        self._rcon_login = (srv["host"], srv["rcon_port"], srv["rcon_password"])
+        self._endpoint = f"{srv['host']}:{srv['rcon_port']}"
+        self._pipeline = bool(self.config.tree("server", "rcon_pipeline"))
         self.client = None
-
-    def _get_client(self):
-        if isinstance(self.client, RCONClient) and self.client.is_authenticated:
+        self._authed = False
+        self._ping_ok_at = -PING_TTL
+        self._rcon_lock = threading.Lock()
+        self._screen_state = False
+        self._screen_folder: Optional[Path] = None
+        self._screen_checked = -SCREEN_TTL
+
+    def _get_client(self, timeout: float = RCON_TIMEOUT):
+        # Keep using the same connection for every command this run
+        if self._authed:
             return self.client
 
-        host = self.config.data["server"]["host"]
-        port = self.config.data["server"]["rcon_port"]
-        password = self.config.data["server"]["rcon_password"]
+        # mctools pulls in networking modules, only load it when RCON is used
+        from mctools import RCONClient
 
-        debug_echo(self.config.debug, f"Connecting to RCON {host}:{port}")
+        host, port, password = self._rcon_login
 
-        self.client = RCONClient(host, port, format_method=RCONClient.REMOVE)
-        if not self.client.login(password):
-            debug_echo(self.config.debug, "Connection refused")
-            raise ConnectionRefusedError
+        debug_echo(self.debug, f"Connecting to RCON {host}:{port}")
 
-        debug_echo(self.config.debug, "Connection complete")
+        self.client = RCONClient(
+            _resolve(host),
+            port,
+            format_method=RCONClient.REMOVE,
+            timeout=timeout,  # type: ignore
+        )
+        try:
+            logged_in = self.client.login(password)
+            if not logged_in:
+                debug_echo(self.debug, "Connection refused")
+                raise ConnectionRefusedError
+        except BaseException as e:
+            # Never keep a half open client, the next call starts again
+            self.close()
+            if isinstance(e, socket.gaierror):
+                # Only a failed lookup is forgotten. Refused connects are the
+                # normal case while start() waits, and must keep the cache
+                _resolve.cache_clear()
+            raise
+
+        debug_echo(self.debug, "Connection complete")
+        self._authed = True
+        if timeout != RCON_TIMEOUT:
+            # Only connecting needed to be quick, commands can take a while
+            self.client.set_timeout(RCON_TIMEOUT)
+        self._keepalive(self.client.proto.sock)
         return self.client
 
-    def _raw_send(self, commands: List[str]):
-        r = list()
+    @staticmethod
+    def _keepalive(sock: socket.socket) -> None:
+        """Have the OS probe idle connections, so a dead server is noticed
+        rather than hanging the next command."""
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+    @staticmethod
+    def connection_errors() -> tuple:
+        """Errors meaning the RCON connection failed, mctools' own included.
+
+        Only used in except clauses, so mctools is still imported lazily.
+        """
+        from mctools.errors import MCToolsError
+
+        return (OSError, MCToolsError)
+
+    def close(self):
+        """Close the RCON connection if one was opened."""
+        self._authed = False
+        self._ping_ok_at = -PING_TTL
+        if self.client is not None:
+            self.client.stop()
+            self.client = None
+
+    @contextlib.contextmanager
+    def session(self):
+        """Share one RCON connection between everything sent in the block.
+
+        The connection is made by the first command and closed on exit.
+        """
+        try:
+            yield self
+        finally:
+            self.close()
+
+    def _raw_send(self, commands: Sequence[str]):
+        try:
+            if len(commands) > 1 and self._pipeline:
+                return self._raw_send_pipelined(commands)
+
+            rcon = self._get_client()
+
+            if self.debug:
+                for command in commands:
+                    click.echo(f"Command send: {command}")
+
+            return [(command, rcon.command(command)) for command in commands]
+        except BaseException:
+            # Whatever went wrong, the connection can't be trusted any more, so
+            # log in again next time rather than reuse it
+            self.close()
+            raise
+
+    def _raw_send_pipelined(self, commands: Sequence[str]):
+        """Write every command at once, then read all the replies
+
+        Each command is sent with its index as the request id. The server answers
+        in order, so a trailing junk packet, which it replies to with an error,
+        marks the end of the replies, including any split over several packets.
+
+        Vanilla servers read one packet per read and discard the rest of the
+        buffer, so every command after the first is lost and this waits for
+        replies that never come. server.rcon_pipeline is off by default for that.
+        """
+        from mctools.packet import RCONPacket
+
         rcon = self._get_client()
 
-        for command in commands:
+        data = bytearray()
+        for reqid, command in enumerate(commands, start=1):
             debug_echo(self.debug, f"Command send: {command}")
-            r.append((command, rcon.command(command)))
+            data += bytes(RCONPacket(reqid, RCONPacket.COMMAND, command))
+        data += bytes(RCONPacket(0, RCONPacket.RESPONSE, ""))
+        rcon.proto.write_tcp(bytes(data))
+
+        replies = [""] * len(commands)
+        while True:
+            pack = rcon.proto.read()
+            if pack.reqid == -1:
+                raise ConnectionRefusedError("RCON session is not logged in")
+            if not 0 < pack.reqid <= len(commands):
+                break
+            replies[pack.reqid - 1] += pack.payload
 
-        return r
+        return [
+            (command, rcon.formatters.clean(reply, command))
+            for command, reply in zip(commands, replies)
+        ]
 
     def _ping_server(self, command: Optional[str] = None) -> Union[str, bool]:
+        # A server that just answered is still up, skip asking again so soon
+        if not command and time.monotonic() - self._ping_ok_at < PING_TTL:
+            return True
+
         try:
-            rcon = self._get_client()
+            rcon = self._get_client(PING_TIMEOUT)
             if command:
                 return str(rcon.command(command, return_packet=False))
 
+            self._ping_ok_at = time.monotonic()
             return True
-        except ConnectionRefusedError:
+        except self.connection_errors():
+            # Covers refused connections and timeouts, the server isn't up yet
+            self.close()
             click.echo("RCON connect timeout")
             return False
 
-    def rcon_send(self, commands: List[str]):
+    def endpoint(self) -> str:
+        return self._endpoint
+
+    def rcon_send(self, commands: Sequence[str]):
         if isinstance(commands, str):
             commands = [commands]
+
+        # One RCON session is shared, so batches from other threads take turns
+        with self._rcon_lock:
+            return self._rcon_send(commands)
+
+    def _rcon_send(self, commands: Sequence[str]):
+        # A running rcon-daemon already has a login, so skip connecting ourselves
+        if self.client is None:
+            responses = daemon.send(self.endpoint(), commands)
+            if responses is not None:
+                debug_echo(self.debug, "Sent through the rcon daemon")
+                return list(zip(commands, responses))
+
         try:
             debug_echo(self.debug, "Starting to login...")
             return self._raw_send(commands)
         except ConnectionRefusedError as e:
             debug_echo(self.debug, str(e))
-            host = self.config.data["server"]["host"]
-            port = self.config.data["server"]["rcon_port"]
-            raise click.UsageError(f"Unable to connect to server {host}:{port}")
+            raise click.UsageError(f"Unable to connect to server {self.endpoint()}")
 
     def save_off(self):
         if not self.screen_exists():
             click.echo("Server is not live, save-off not needed.")
             return self
 
-        self.rcon_send(["/save-all"])
+        # flush makes save-all finish writing before it answers, so both can go
+        # in one send, with a single pause for anything still settling on disk
+        self.rcon_send(["/save-all flush", "/save-off"])
         time.sleep(3)
-        self.rcon_send(["/save-off"])
-        time.sleep(2)
         return self
 
     def save_on(self):
@@ -156,36 +384,172 @@ class ServerManager:
         time.sleep(2)
         return self
 
-    def screen_exists(self) -> bool:
-        command = ["screen", "-list", "mcs"]
-        retcode = subprocess.call(command, stdout=subprocess.PIPE)
-        if retcode == 0:
-            return True
+    def screen_exists(self, fresh: bool = False) -> bool:
+        # Several checks happen back to back, so reuse a very recent answer
+        now = time.monotonic()
+        if not fresh and now - self._screen_checked < SCREEN_TTL:
+            return self._screen_state
+
+        self._screen_state = self._screen_alive()
+        self._screen_checked = time.monotonic()
+        return self._screen_state
+
+    def _screen_alive(self) -> bool:
+        """Whether the mcs session is running, asked fresh every time."""
+        pids = self._screen_pids()
+        if pids is not None:
+            return bool(pids)
+
+        # No socket folder to read, so fork screen and go by its exit code
+        result = subprocess.run(
+            ["screen", "-list", "mcs"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            close_fds=False,
+            check=False,
+        )
+        return result.returncode == 0
+
+    def _invalidate_screen_cache(self) -> None:
+        """Forget the last answer, for when the session has just started or stopped."""
+        self._screen_checked = -SCREEN_TTL
+
+    def _screen_dir(self) -> Optional[Path]:
+        """Folder screen keeps its session sockets in, if we can find it.
+
+        Once found it's remembered, a miss is looked for again next time as
+        screen only makes the folder when the first session starts.
+        """
+        if self._screen_folder is not None:
+            return self._screen_folder
+
+        if os.environ.get("SCREENDIR"):
+            self._screen_folder = Path(os.environ["SCREENDIR"])
+            return self._screen_folder
+
+        user = getpass.getuser()
+        for base in SCREEN_DIRS:
+            folder = Path(base, f"S-{user}")
+            if folder.is_dir():
+                self._screen_folder = folder
+                return folder
+        return None
+
+    def _screen_pids(self) -> Optional[List[int]]:
+        """Pids of the live mcs sessions, read from screen's socket folder
+
+        Saves forking screen. Returns None if the folder can't be found, so the
+        caller can ask screen instead.
+        """
+        folder = self._screen_dir()
+        if folder is None:
+            return None
+
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return None
+
+        # Sockets are named pid.name, skip any left behind by a dead session
+        pids = [
+            int(name.split(".", 1)[0]) for name in names if SCREEN_SOCKET.match(name)
+        ]
+        return [pid for pid in pids if _pid_alive(pid)]
+
+    def _screen_pid(self) -> Optional[int]:
+        """Find the pid of the mcs screen session, if there is one."""
+        pids = self._screen_pids()
+        if pids is not None:
+            return pids[0] if pids else None
+
+        result = subprocess.run(
+            ["screen", "-list", "mcs"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        match = re.search(r"^\s*(\d+)\.mcs\s", result.stdout, re.MULTILINE)
+        return int(match.group(1)) if match else None
+
+    def _wait_for_exit(self, pid: Optional[int], timeout: float) -> bool:
+        """Wait for the screen session to exit
+
+        On Linux a pidfd for the session wakes us as soon as it exits. Otherwise
+        signal 0 checks the pid is still there, which saves forking screen each
+        time. Without a pid we fall back to asking screen.
+        """
+        if pid is not None and hasattr(os, "pidfd_open"):
+            try:
+                fd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                return True
+            except OSError:
+                # Older kernel, poll the pid below instead
+                pass
+            else:
+                try:
+                    ready, _, _ = select.select([fd], [], [], timeout)
+                    return bool(ready)
+                finally:
+                    os.close(fd)
+
+        deadline = time.monotonic() + timeout
+        wait = 0.25
+        while time.monotonic() < deadline:
+            if pid is None:
+                if not self.screen_exists(fresh=True):
+                    return True
+                # Usually gone within seconds, but a big world takes a while to save
+                time.sleep(wait)
+                wait = min(wait * 2, 2)
+                continue
+
+            if not _pid_alive(pid):
+                return True
+            time.sleep(0.2)
+
         return False
 
     def _follow(self, logfile: Path):
         """Generator that'll seek the end of the file
 
+        Yields every complete line written since the last batch together, so
+        they can be printed in one go, or False if the log goes quiet. With
+        inotify_simple installed this sleeps until the file is written to,
+        otherwise it polls.
+
         Args:
             logfile (Path): File to seek
         """
-        count = 0
-
-        with open(logfile, "r") as f:
-            f.seek(0, SEEK_END)
-
+        with contextlib.ExitStack() as stack:
+            # A raw fd skips the text layer, lines are only decoded once complete
+            fd = os.open(logfile, os.O_RDONLY | os.O_NONBLOCK)
+            stack.callback(os.close, fd)
+            if INotify is not None:
+                inotify = stack.enter_context(INotify())
+                # Watch before seeking so nothing written in between is missed
+                inotify.add_watch(logfile, flags.MODIFY | flags.CLOSE_WRITE)
+                wait = functools.partial(inotify.read, timeout=100)
+            else:
+                wait = functools.partial(time.sleep, 0.1)
+            os.lseek(fd, 0, SEEK_END)
+
+            pending = b""
+            last = time.monotonic()
             while True:
-                line = f.readline()
-                if not line:
-                    time.sleep(0.1)
-                    count = count + 1
-                    if count > 500:
-                        click.echo("No response from log file")
-                        yield False
+                chunk = os.read(fd, 65536)
+                if chunk:
+                    last = time.monotonic()
+                    # The last piece is a half written line, or empty
+                    *lines, pending = (pending + chunk).split(b"\n")
+                    if lines:
+                        yield [line.decode("utf-8", "replace") + "\n" for line in lines]
                     continue
 
-                count = 0
-                yield line
+                if time.monotonic() - last > FOLLOW_TIMEOUT:
+                    click.echo("No response from log file")
+                    yield False
+                wait()
 
     def _screen_start(
         self,
@@ -200,6 +564,8 @@ class ServerManager:
                 time.strftime("%Y%m%d"),
             )
 
+        # The script's folder is the working directory and where the log goes
+        folder = startup_script.parent
         command = [
             "screen",
             "-dmS",
@@ -216,45 +582,53 @@ class ServerManager:
             click.echo(f"Command: {' '.join(command)}")
             return False
 
-        code = subprocess.call(
+        # screen -dm detaches straight away, the session logs to the Logfile
+        code = subprocess.run(
             command,
-            cwd=str(startup_script.parent),
-            stderr=subprocess.STDOUT,
-        )
+            cwd=folder,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False,
+        ).returncode
+        self._invalidate_screen_cache()
         if code == 1 and not self.screen_exists():
             click.echo("There was an error with the startup script.")
             raise SystemExit
 
         # We're going to tail the output for a bit
-        log = startup_script.parent.joinpath(screen_logs_name)
-        click.echo(f"Run tail -f {str(log)} to see what's happening")
+        log = folder.joinpath(screen_logs_name)
+        click.echo(f"Run tail -f {log} to see what's happening")
 
-        # Wait for the file to exist
-        i = 0
-        while not log.exists() and i < 100:
-            time.sleep(0.2)
+        # Wait up to 10 seconds for the file to exist
+        deadline = time.monotonic() + 10
+        while not log.exists() and time.monotonic() < deadline:
+            time.sleep(0.1)
 
         if log.exists():
-            end = time.time() + sleep
+            end = time.monotonic() + sleep
 
             click.echo("Printing out the logs for a bit...")
             click.echo("=======")
 
-            for line in self._follow(log):
-                if not line:
+            for lines in self._follow(log):
+                if not lines:
                     break
-                click.echo(f"{line.rstrip()}")
-                if time.time() > end:
+                # One write for the whole batch, a booting server logs a lot
+                click.echo("".join(lines), nl=False)
+                if time.monotonic() > end:
                     break
-                if "Incompatible mod set!" in line:
+                if any("Incompatible mod set!" in line for line in lines):
                     break
 
             click.echo("=======")
         else:
-            time.sleep(sleep)
+            # No log to follow, move on as soon as the session shows up
+            deadline = time.monotonic() + sleep
+            while time.monotonic() < deadline and not self.screen_exists(fresh=True):
+                time.sleep(0.25)
 
         # Check, is our screen running?
-        if not self.screen_exists():
+        if not self.screen_exists(fresh=True):
             click.echo(f"No screen session was detected after {sleep} seconds.")
             return False
 
@@ -267,40 +641,93 @@ class ServerManager:
         color: str = "gray",
         italic: bool = False,
         play_sound: bool = True,
-        sound: str = "block.amethyst_block.resonate",
+        sound: str = DEFAULT_SOUND,
         prefixed: bool = True,
+        batch: Optional[List[str]] = None,
+        assume_running: bool = False,
     ):
-        if not self.screen_exists():
-            click.echo(f"Server not running, did not send: {message}")
-            return
+        """Send a message to everyone on the server
 
-        message_list = []
-        if isinstance(message, List):
-            message_list = message
+        Given a batch, the commands are added to it for the caller to send along
+        with others, rather than being sent straight away. Callers that have
+        just checked the server is up can skip checking again with
+        assume_running.
+        """
+        if isinstance(message, list):
+            # Lists aren't hashable, and are rarely sent twice anyway
+            text, tellraw = self._build_tellraw(message, color, italic, prefixed)
+            commands = [_build_playsound(sound), tellraw] if play_sound else [tellraw]
         else:
-            message_list.append(
-                {
-                    "text": message,
-                    "color": color,
-                    "italic": italic,
-                },
+            # The cached tuple is sent as is, nothing downstream changes it
+            text, commands = self._build_commands(
+                message,
+                color,
+                italic,
+                play_sound,
+                sound,
+                prefixed,
             )
+        self._broadcast(text, commands, batch, assume_running)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _build_commands(
+        message: str,
+        color: str,
+        italic: bool,
+        play_sound: bool,
+        sound: str,
+        prefixed: bool,
+    ) -> Tuple[str, Tuple[str, ...]]:
+        """Everything sent for a plain message, the same few get sent a lot."""
+        text, tellraw = ServerManager._build_tellraw(message, color, italic, prefixed)
+        if play_sound:
+            return text, (_build_playsound(sound), tellraw)
+        return text, (tellraw,)
 
-        if prefixed:
-            message_list = text_prefix() + message_list
+    @staticmethod
+    def _build_tellraw(
+        message: Union[str, List],
+        color: str = "gray",
+        italic: bool = False,
+        prefixed: bool = True,
+    ) -> Tuple[str, str]:
+        """The plain text to echo and the /tellraw command for a message."""
+        if isinstance(message, list):
+            msgs = [msg["text"] for msg in message]
+            payload = json.dumps(obj=message, indent=None, separators=(",", ":"))
+            if prefixed:
+                # Only the components are dumped, the prefix is already JSON
+                msgs = [PREFIX_TEXT, *msgs]
+                payload = (
+                    f"{PREFIX_JSON},{payload[1:]}" if message else PREFIX_JSON + "]"
+                )
+        else:
+            # Plain text, splice it into the pre-serialised prefix rather than
+            # building and dumping the whole list every time
+            msgs = [PREFIX_TEXT, message] if prefixed else [message]
+            part = _format_tellraw(message, color, italic)
+            payload = f"{PREFIX_JSON},{part}]" if prefixed else f"[{part}]"
 
-        msgs = [msg["text"] for msg in message_list]
-        click.echo(f'Broadcasted: {"".join(msgs)}')
+        return "".join(msgs), "/tellraw @a %s" % payload
 
-        commands = [
-            "/tellraw @a %s"
-            % json.dumps(obj=message_list, indent=None, separators=(",", ":")),
-        ]
-        if play_sound:
-            commands.insert(0, f"/playsound minecraft:{sound} master @a 0 0 0 10 0.6 1")
+    def _broadcast(
+        self,
+        text: str,
+        commands: Sequence[str],
+        batch: Optional[List[str]] = None,
+        assume_running: bool = False,
+    ) -> None:
+        if not assume_running and not self.screen_exists():
+            click.echo(f"Server not running, did not send: {text}")
+            return
 
-        debug_echo(self.config.debug, "\n".join(commands))
-        self.rcon_send(commands)
+        click.echo(f"Broadcasted: {text}")
+        debug_echo(self.debug, "\n".join(commands))
+        if batch is None:
+            self.rcon_send(commands)
+        else:
+            batch.extend(commands)
 
     def start(self):
         if self.screen_exists():
@@ -315,7 +742,7 @@ class ServerManager:
         startup = Path(self.config.get_str("startup_script"))
 
         if not self._screen_start(
-            self.config.debug,
+            self.debug,
             startup,
             self.config.get_int("boot_pause"),
             self.config.get_str("screen_logs_name"),
@@ -323,21 +750,24 @@ class ServerManager:
             raise SystemExit
 
         # Now we want to wait for Minecraft to be up and good
-        # We're going to check about 10 times with a pause between each
-        # And try to rcon
+        # Check often at first then back off, giving up after about as long as
+        # the old ten 10 second pauses
         # If rcon is not configured then this might be a problem
 
         loaded = False
-        for i in range(10):
-            # We want to check if our screen window is alive
-
+        deadline = time.monotonic() + START_TIMEOUT
+        wait = 0.5
+        while True:
             # Are we alive?
             click.echo("Checking if the server is up yet...")
             if self._ping_server():
                 loaded = True
                 break
+            if time.monotonic() + wait > deadline:
+                break
             click.echo("Not yet, waiting a few moments...")
-            time.sleep(10)
+            time.sleep(wait)
+            wait = min(wait * 1.5, 10)
 
         if loaded:
             click.echo("Server has been loaded.")
@@ -347,47 +777,99 @@ class ServerManager:
             )
             click.echo("Make sure rcon/query has been configured")
 
-    def stop(self, countdown: int = 5, action: str = "stopping"):
-        if not self.screen_exists() and not self._ping_server():
-            click.echo("Server is not running")
-            return
-
-        if countdown < 5:
-            countdown = 5
-
+    def _announce_stop(
+        self,
+        countdown: int,
+        action: str,
+        batch: Optional[List[str]],
+    ) -> None:
+        """Send stop()'s countdown, up to the pause before /stop."""
+        batch = list(batch or [])
         for sleep, text in seconds_to_countdown(countdown):
+            # Announcements with no wait between them share one send
+            if sleep and batch:
+                self.rcon_send(batch)
+                batch = []
             time.sleep(sleep)
             if text:
                 self.tell_all(
                     f"The server is {action} in {text}",
+                    batch=batch,
+                    assume_running=True,
                 )
-
-        # Final 5-second countdown
-        for i in range(5, 0, -1):
-            self.tell_all(f"In {i}...")
-            time.sleep(1)
+        if batch:
+            self.rcon_send(batch)
+
+        # Final 5-second countdown, built up front and sent from a worker so
+        # RCON latency doesn't stretch the seconds
+        sound = _build_playsound(DEFAULT_SOUND)
+        messages = [self._build_tellraw(f"In {i}...") for i in range(5, 0, -1)]
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            ticks = []
+            # Each tick is due a whole second after the first, so time spent
+            # submitting doesn't add up over the five
+            begin = time.monotonic()
+            for due, (text, tellraw) in enumerate(messages, start=1):
+                ticks.append(
+                    pool.submit(
+                        self._broadcast,
+                        text,
+                        [sound, tellraw],
+                        assume_running=True,
+                    ),
+                )
+                time.sleep(max(0.0, begin + due - time.monotonic()))
+            for tick in ticks:
+                tick.result()
 
         # playsound minecraft:ui.toast.challenge_complete master @s ~ ~ ~ 0.49 1.29
-        self.tell_all("Off we go!", sound="entity.tnt.primed")
+        self.tell_all("Off we go!", sound="entity.tnt.primed", assume_running=True)
         time.sleep(2)
-        self.rcon_send(
-            [
-                f"/kick @a Sever is {action}, check Discord for info",
-                "/stop",
-            ],
-        )
 
-        # Now wait
-        time.sleep(1)
-        down = False
-        if self.screen_exists():
-            for i in range(1, 100):
-                if not self.screen_exists():
-                    down = True
-                    break
-                time.sleep(2)
-        else:
-            down = True
+    def stop(
+        self,
+        countdown: int = 5,
+        action: str = "stopping",
+        batch: Optional[List[str]] = None,
+    ):
+        """Count down, then stop the server
+
+        Any commands already in the batch go out with the first announcement.
+        """
+        # The screen check is cheap and usually enough, only ping when it's gone
+        # in case the server was started some other way
+        alive = self.screen_exists() or self._ping_server()
+        if not alive:
+            click.echo("Server is not running")
+            return
+
+        if countdown < 5:
+            countdown = 5
+
+        # Everything up to /stop goes over the one connection, which is then
+        # closed rather than left for the server to drop
+        with self.session():
+            try:
+                self._announce_stop(countdown, action, batch)
+                lost = False
+            except (click.ClickException, *self.connection_errors()) as e:
+                # It went down part way through, so just wait for it to be gone
+                click.echo(f"Lost the server during the countdown: {e}")
+                self.close()
+                lost = True
+
+            pid = self._screen_pid()
+            if not lost:
+                self.rcon_send(
+                    [
+                        f"/kick @a Sever is {action}, check Discord for info",
+                        "/stop",
+                    ],
+                )
+            self._invalidate_screen_cache()
+
+        # Now wait for the session to go away
+        down = self._wait_for_exit(pid, 200)
 
         if down:
             click.echo("Server has stopped")
@@ -0,0 +1,244 @@
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import click
+import pytest
+
+from cmcserver.backup import BackupManager
+from cmcserver.configuration import Config
+from cmcserver.server import ServerManager
+
+
+def test_first_copy(tmp_path: Path, monkeypatch):
+    game = tmp_path.joinpath("game")
+    world = game.joinpath("world")
+    for name in ("level.dat", "region/r.0.0.mca", "region/r.0.1.mca", ".git/HEAD"):
+        world.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+        world.joinpath(name).write_text(name)
+    outside = tmp_path.joinpath("outside.txt")
+    outside.write_text("outside")
+    world.joinpath("link").symlink_to(outside)
+
+    config = Config(
+        {"game_folder": str(game), "backups": {"folder": str(tmp_path / "backups")}},
+        False,
+    )
+    manager = BackupManager(ServerManager(config))
+    monkeypatch.setattr(manager, "_supports_reflink", lambda: False)
+    for folder in (world, world.joinpath("region")):
+        os.utime(folder, (1_000_000_000, 1_000_000_000))
+
+    assert manager._first_copy()
+    copied = manager.backup_dest_world
+    # Folder times survive the files being written into them afterwards
+    assert copied.stat().st_mtime == 1_000_000_000
+    assert copied.joinpath("region").stat().st_mtime == 1_000_000_000
+    assert copied.joinpath("region/r.0.1.mca").read_text() == "region/r.0.1.mca"
+    assert copied.joinpath("level.dat").read_text() == "level.dat"
+    assert not copied.joinpath(".git").exists()
+    # Links are copied as links, not followed
+    assert os.readlink(copied.joinpath("link")) == str(outside)
+
+    # Already copied, so leave it to rsync next time
+    assert not manager._first_copy()
+
+
+def test_reflink_sync_replaces_copy_on_success(tmp_path: Path, monkeypatch):
+    world = tmp_path.joinpath("game", "world")
+    world.joinpath(".git").mkdir(parents=True)
+    world.joinpath("level.dat").write_text("new")
+
+    config = Config(
+        {
+            "game_folder": str(world.parent),
+            "backups": {"folder": str(tmp_path / "backups")},
+        },
+        False,
+    )
+    manager = BackupManager(ServerManager(config))
+    manager.backup_dest_world.mkdir(parents=True)
+    manager.backup_dest_world.joinpath("level.dat").write_text("old")
+    monkeypatch.setattr(manager, "_supports_reflink", lambda: True)
+    monkeypatch.setattr(manager.server, "save_off", lambda: None)
+    monkeypatch.setattr(manager.server, "save_on", lambda: None)
+
+    # Building the command leaves the old copy alone
+    monkeypatch.setattr(manager, "_reflink_command", lambda: ["false"])
+    manager._sync_command()
+    manager.sync_world_folder()
+    assert manager.backup_dest_world.joinpath("level.dat").read_text() == "old"
+    assert not manager._reflink_staging().exists()
+
+    monkeypatch.setattr(manager, "_reflink_command", lambda: ["cp", "-a"])
+    manager.sync_world_folder()
+    assert manager.backup_dest_world.joinpath("level.dat").read_text() == "new"
+    assert not manager.backup_dest_world.joinpath(".git").exists()
+    assert sorted(os.listdir(manager.backup_dest)) == ["world"]
+
+
+def test_prune_aws_reports_failures(tmp_path: Path, monkeypatch, capsys):
+    config = Config(
+        {
+            "backups": {
+                "folder": str(tmp_path / "backups"),
+                "aws": {"bucket": "bucket", "subfolder": "worlds"},
+            },
+        },
+        False,
+    )
+    manager = BackupManager(ServerManager(config))
+
+    class FakeS3:
+        def get_paginator(self, name):
+            return self
+
+        def paginate(self, **kwargs):
+            keys = ["world-1.tar.zst", "world-2.tar.zst", "world-3.tar.zst"]
+            return [{"Contents": [{"Key": f"worlds/{key}"} for key in keys]}]
+
+        def delete_objects(self, Bucket, Delete):
+            assert Delete["Quiet"]
+            return {
+                "Errors": [{"Key": "worlds/world-2.tar.zst", "Code": "AccessDenied"}],
+            }
+
+    monkeypatch.setattr(manager, "_s3", lambda: FakeS3())
+
+    with pytest.raises(click.ClickException, match="world-2.tar.zst"):
+        manager.prune_aws(1, True)
+    out = capsys.readouterr().out
+    assert "Deleted worlds/world-1.tar.zst" in out
+    assert "Deleted worlds/world-2.tar.zst" not in out
+
+
+def test_failed_upload_reaps_pipeline(tmp_path: Path, monkeypatch):
+    config = Config(
+        {
+            "game_folder": str(tmp_path / "game"),
+            "backups": {
+                "folder": str(tmp_path / "backups"),
+                "compress": "gzip",
+                "aws": {"bucket": "bucket"},
+            },
+        },
+        False,
+    )
+    manager = BackupManager(ServerManager(config))
+    manager.backup_dest_world.mkdir(parents=True)
+    manager.backup_dest_world.joinpath("level.dat").write_bytes(os.urandom(1 << 20))
+
+    started = []
+
+    class TrackedPopen(subprocess.Popen):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            started.append(self)
+
+    class FailingS3:
+        def upload_fileobj(self, **kwargs):
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(subprocess, "Popen", TrackedPopen)
+    monkeypatch.setattr(manager, "_s3", lambda: FailingS3())
+
+    with pytest.raises(KeyboardInterrupt):
+        manager.compress_and_upload()
+    assert len(started) == 2
+    assert all(proc.returncode is not None for proc in started)
+
+
+def test_pzstd_only_without_rsyncable(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(shutil, "which", lambda name: f"/usr/bin/{name}")
+
+    def manager(compress: str) -> BackupManager:
+        backups = {"folder": str(tmp_path / "backups"), "compress": compress}
+        return BackupManager(ServerManager(Config({"backups": backups}, False)))
+
+    assert manager("/usr/bin/zstd -T0 -3 --rsyncable")._pzstd_command(None) is None
+    assert manager("gzip")._pzstd_command(None) is None
+
+    command = manager("/usr/bin/zstd -T0 -10")._pzstd_command("out.tar.zst")
+    assert command[0] == "/usr/bin/pzstd"
+    assert command[-3:] == ["-10", "-o", "out.tar.zst"]
+
+
+def test_failed_tar_removes_upload(tmp_path: Path, monkeypatch):
+    config = Config(
+        {
+            "game_folder": str(tmp_path / "game"),
+            "backups": {
+                "folder": str(tmp_path / "backups"),
+                "compress": "gzip",
+                "aws": {"bucket": "b"},
+            },
+        },
+        False,
+    )
+    manager = BackupManager(ServerManager(config))
+    calls = []
+
+    class FakeS3:
+        def upload_fileobj(self, Fileobj, Key, **kwargs):
+            # The upload itself works, tar fails as there's no world to archive
+            Fileobj.read()
+            calls.append(("upload", Key))
+
+        def delete_object(self, Bucket, Key):
+            calls.append(("delete", Key))
+
+    monkeypatch.setattr(manager, "_s3", lambda: FakeS3())
+
+    with pytest.raises(click.ClickException, match="incomplete"):
+        manager.compress_and_upload(key="world.tar.zst")
+    assert calls == [("upload", "world.tar.zst"), ("delete", "world.tar.zst")]
+
+
+def test_git_sync_without_changes(tmp_path: Path, monkeypatch, capsys):
+    for var in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{var}_NAME", "test")
+        monkeypatch.setenv(f"GIT_{var}_EMAIL", "test@example.com")
+    config = Config({"backups": {"folder": str(tmp_path / "backups")}}, False)
+    manager = BackupManager(ServerManager(config))
+    world = manager.backup_dest_world
+    world.mkdir(parents=True)
+    world.joinpath("level.dat").write_text("one")
+    for command in (["init", "-q"], ["add", "."], ["commit", "-qm", "first"]):
+        subprocess.run(["git", *command], cwd=world, check=True)
+
+    manager.git_sync()
+    captured = capsys.readouterr()
+    assert "Nothing changed" in captured.out
+    assert "Command failed" not in captured.err
+
+    world.joinpath("level.dat").write_text("two")
+    manager.git_sync()
+    assert "Command failed" not in capsys.readouterr().err
+    log = subprocess.run(["git", "log", "--oneline"], cwd=world, capture_output=True)
+    assert log.stdout.count(b"\n") == 2
+
+
+def test_aws_sync_newest_elsewhere(tmp_path: Path, monkeypatch, capsys):
+    config = Config(
+        {"backups": {"folder": str(tmp_path / "backups"), "aws": {"bucket": "b"}}},
+        False,
+    )
+    manager = BackupManager(ServerManager(config))
+    for name in ("world_20240101_000000.tar.zst", "world_20240301_000000.tar.zst"):
+        manager.backup_dest.joinpath(name).touch()
+    # The archive just made sorts before one that's already in both places
+    manager.last_archive = str(
+        manager.backup_dest.joinpath("world_20240101_000000.tar.zst"),
+    )
+    monkeypatch.setattr(manager, "_s3", lambda: None)
+    monkeypatch.setattr(
+        manager,
+        "_list_aws",
+        lambda s3, bucket, subfolder: iter(["world_20240301_000000.tar.zst"]),
+    )
+
+    manager.aws_sync(limit=1)
+    out = capsys.readouterr().out
+    assert "Missing from local: None" in out
+    assert "Missing from S3 (prefix ): None" in out
@@ -0,0 +1,103 @@
+import os
+import tomllib
+from pathlib import Path
+
+from cmcserver.configuration import Config, default_config
+
+
+def test_load_cache(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))
+    monkeypatch.delenv("CMC_NO_CACHE", raising=False)
+    config_file = tmp_path.joinpath("cmcserver.toml")
+    config_file.write_text('world = "first"\n')
+
+    cache = Config.cache_path(config_file)
+    assert cache.is_relative_to(tmp_path.joinpath("cache"))
+    assert not cache.exists()
+
+    # First load parses and writes a private cache
+    assert Config.load(config_file, False).get_str("world") == "first"
+    assert cache.exists()
+    assert cache.stat().st_mode & 0o777 == 0o600
+
+    # Second load comes from the cache, as long as the mtime and size match
+    st = config_file.stat()
+    config_file.write_text('world = "other"\n')
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert Config.load(config_file, False).get_str("world") == "first"
+
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert Config.load(config_file, False).get_str("world") == "other"
+
+    # Unless it's turned off
+    monkeypatch.setenv("CMC_NO_CACHE", "1")
+    config_file.write_text('world = "third"\n')
+    assert Config.load(config_file, False).get_str("world") == "third"
+
+
+def test_flatten():
+    cfg = Config({"server": {"rcon_password": "secret", "rcon_port": 0}}, False)
+    lines = cfg.flatten().splitlines()
+    assert lines == sorted(lines)
+
+    rows = dict(line.split(maxsplit=1) for line in lines)
+    assert rows["server.rcon_password:"] == "*****"
+    assert rows["server.rcon_port:"] == "0"
+    assert rows["backups.git.push:"] == "False"
+
+    # Every value lines up in the same column
+    width = max(map(len, rows)) + 2
+    assert {len(line) - len(line[width:].lstrip()) for line in lines} == {width}
+
+
+def test_nested_defaults():
+    cfg = Config({"server": {"rcon_port": 1234}, "world": "other"}, False)
+
+    assert cfg.tree("server", "rcon_port") == 1234
+    assert cfg.tree("server", "host") == "127.0.0.1"
+    assert cfg.tree("backups", "aws", "bucket") == ""
+    assert cfg.get_str("world") == "other"
+
+
+def test_load_cache_must_be_private(tmp_path: Path, monkeypatch):
+    monkeypatch.delenv("CMC_NO_CACHE", raising=False)
+    config_file = tmp_path.joinpath("cmcserver.toml")
+    config_file.write_text('world = "first"\n')
+    other_file = tmp_path.joinpath("other.toml")
+    other_file.write_text('world = "other"\n')
+
+    # One cache file, holding whichever config was loaded last
+    cache = Config.cache_path(config_file)
+    Config.load(config_file, False)
+    Config.load(other_file, False)
+    assert list(cache.parent.iterdir()) == [cache]
+    assert Config.load(config_file, False).get_str("world") == "first"
+
+    # A cache someone else could have written is never unpickled
+    st = config_file.stat()
+    config_file.write_text('world = "new"\n')
+    os.utime(config_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+    cache.chmod(0o622)
+    assert Config.load(config_file, False).get_str("world") == "new"
+
+
+def test_complete_config_is_not_copied():
+    doc = tomllib.loads(Config.dumps())
+    assert Config(doc, False).data is doc
+
+
+def test_load_large(tmp_path: Path, monkeypatch):
+    monkeypatch.setenv("CMC_NO_CACHE", "1")
+    config_file = tmp_path.joinpath("cmcserver.toml")
+    config_file.write_text("# padding\n" * 1000 + 'world = "wörld"\n', encoding="utf-8")
+
+    assert Config.load(config_file, False).get_str("world") == "wörld"
+
+
+def test_filled_in_defaults_are_copied():
+    first = Config({}, False)
+    first.data["backups"]["aws"]["bucket"] = "changed"
+
+    second = Config({}, False)
+    assert second.tree("backups", "aws", "bucket") == ""
+    assert default_config()["backups"] == second.get_dict("backups")
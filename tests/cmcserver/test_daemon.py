@@ -0,0 +1,149 @@
+import socket
+import threading
+from types import SimpleNamespace
+
+import click
+import pytest
+
+from cmcserver import daemon
+from cmcserver.configuration import Config
+from cmcserver.daemon import RconDaemon, read_message, write_message
+from cmcserver.server import ServerManager
+
+config = Config(dict(), False)
+
+
+def test_handle(monkeypatch):
+    server = ServerManager(config)
+    monkeypatch.setattr(server, "_get_client", lambda: None)
+    monkeypatch.setattr(
+        server,
+        "_raw_send",
+        lambda commands: [(c, f"ran {c}") for c in commands],
+    )
+    rcon = RconDaemon(server)
+
+    client, conn = socket.socketpair()
+    with client, conn:
+        write_message(client, {"server": "127.0.0.1:25575", "commands": ["a", "b"]})
+        rcon.handle(conn)
+        assert read_message(client) == {"responses": ["ran a", "ran b"]}
+
+        # Requests for another server are turned away
+        write_message(client, {"server": "10.0.0.1:25575", "commands": ["a"]})
+        rcon.handle(conn)
+        assert read_message(client)["sent"] is False
+
+
+def test_failed_send_is_not_retried(monkeypatch):
+    server = ServerManager(config)
+    monkeypatch.setattr(server, "_get_client", lambda: None)
+    sends = []
+
+    def fail(commands):
+        sends.append(commands)
+        raise ConnectionResetError("reset")
+
+    monkeypatch.setattr(server, "_raw_send", fail)
+    rcon = RconDaemon(server)
+
+    client, conn = socket.socketpair()
+    with client, conn:
+        write_message(client, {"server": "127.0.0.1:25575", "commands": ["/stop"]})
+        rcon.handle(conn)
+        reply = read_message(client)
+
+    assert reply["sent"] is True
+    assert sends == [["/stop"]]
+
+
+def test_protocol_error_is_reported():
+    from mctools.errors import ProtoConnectionClosed
+
+    server = ServerManager(config)
+    idle, _ = socket.socketpair()
+
+    class Dead:
+        proto = SimpleNamespace(sock=idle)
+
+        def command(self, command):
+            raise ProtoConnectionClosed("closed")
+
+        def stop(self):
+            idle.close()
+
+    server.client, server._authed = Dead(), True
+    rcon = RconDaemon(server)
+
+    client, conn = socket.socketpair()
+    with client, conn:
+        write_message(client, {"server": "127.0.0.1:25575", "commands": ["/list"]})
+        rcon.handle(conn)
+        reply = read_message(client)
+
+    # Reported rather than killing the daemon, and the dead login is dropped
+    assert reply["sent"] is True
+    assert server.client is None and not server._authed
+
+
+def test_send_raises_once_commands_went_out(tmp_path, monkeypatch):
+    path = tmp_path.joinpath("cmcserver.sock")
+    monkeypatch.setattr(daemon, "socket_path", lambda: path)
+
+    # Nothing listening, so the caller connects itself
+    assert daemon.send("127.0.0.1:25575", ["/stop"]) is None
+
+    def serve(reply):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            listener.bind(str(path))
+            listener.listen()
+            thread = threading.Thread(target=answer, args=(listener, reply))
+            thread.start()
+            try:
+                return daemon.send("127.0.0.1:25575", ["/stop"])
+            finally:
+                thread.join()
+                path.unlink()
+
+    def answer(listener, reply):
+        conn, _ = listener.accept()
+        with conn:
+            read_message(conn)
+            write_message(conn, reply)
+
+    assert serve({"responses": ["ok"]}) == ["ok"]
+    assert serve({"error": "refused", "sent": False}) is None
+    with pytest.raises(click.ClickException):
+        serve({"error": "reset", "sent": True})
+
+
+def test_idle_exit(tmp_path, monkeypatch, capsys):
+    server = ServerManager(config)
+    monkeypatch.setattr(server, "_get_client", lambda: None)
+    path = tmp_path.joinpath("cmcserver.sock")
+
+    RconDaemon(server, path, idle_timeout=0.1).serve_forever()
+    assert "No requests for 0.1 seconds" in capsys.readouterr().out
+    assert not path.exists()
+
+
+def test_socket_folder_is_private(tmp_path, monkeypatch):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(daemon.tempfile, "gettempdir", lambda: str(tmp_path))
+    path = daemon.socket_path()
+    assert path.parent.parent == tmp_path
+
+    daemon._private_dir(path.parent)
+    assert path.parent.stat().st_mode & 0o777 == 0o700
+
+    # A folder someone else could get into isn't trusted
+    path.parent.chmod(0o755)
+    with pytest.raises(click.ClickException):
+        daemon._private_dir(path.parent)
+
+    # Nor is removing something at the path that isn't a socket
+    path.parent.chmod(0o700)
+    path.write_text("not a socket")
+    with pytest.raises(click.ClickException):
+        daemon._remove_stale(path)
+    assert path.exists()
@@ -1,4 +1,7 @@
+import os
+import shutil
 import subprocess
+import sys
 from pathlib import Path
 
 import click
@@ -151,6 +154,38 @@ def test_generate_readme(monkeypatch):
         assert "COMMANDS_HERE" not in content
 
 
+def test_readme_keeps_crlf(tmp_path: Path):
+    readme = tmp_path.joinpath("readme.md")
+    lines = ["GAP0", "[//]: # (config-start) keep", "OLD", "[//]: # (config-end)", ""]
+    readme.write_bytes("\r\n".join(lines).encode())
+
+    config_file = tmp_path.joinpath("cmcserver.toml")
+    CliRunner().invoke(cli, ["--config", str(config_file), "readme", str(readme)])
+
+    content = readme.read_bytes()
+    assert b"OLD" not in content
+    assert b"[//]: # (config-start) keep\r\n```\r\n" in content
+    assert content.count(b"\n") == content.count(b"\r\n")
+
+
+def test_failed_readme_leaves_no_temp(monkeypatch, tmp_path: Path):
+    readme = tmp_path.joinpath("readme.md")
+    readme.write_text("[//]: # (config-start)\n[//]: # (config-end)\n")
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(shutil, "copymode", fail)
+    config_file = tmp_path.joinpath("cmcserver.toml")
+    result = CliRunner().invoke(
+        cli,
+        ["--config", str(config_file), "readme", str(readme)],
+    )
+    assert isinstance(result.exception, OSError)
+    assert [p.name for p in tmp_path.iterdir()] == ["readme.md"]
+    assert readme.read_text() == "[//]: # (config-start)\n[//]: # (config-end)\n"
+
+
 def test_helps():
     runner = CliRunner()
     with runner.isolated_filesystem() as r:
@@ -190,6 +225,11 @@ def test_helps():
         assert "Usage: " in output.output
         assert "chunk management" in output.output
 
+        # Group help doesn't need a config file
+        output = runner.invoke(cli, ["--config", "missing.toml", "server"])
+        assert output.exit_code == 0
+        assert "Restart the server" in output.output
+
 
 def test_mca_select(monkeypatch):
     runner = CliRunner()
@@ -272,3 +312,14 @@ def test_mca_delete(monkeypatch):
             ["--config", config_file, "mca", "delete", "--debug"],
         )
         assert "Delete called with debug: True" in output.output
+
+
+def test_import_keeps_sigwinch_handler():
+    # Run in a fresh interpreter, so the import really happens
+    code = (
+        "import signal; signal.signal(signal.SIGWINCH, signal.SIG_IGN); "
+        "import cmcserver.main; "
+        "assert signal.getsignal(signal.SIGWINCH) is signal.SIG_IGN"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
@@ -49,3 +49,25 @@ def test_query(monkeypatch, capsys):
         assert "--mode select" in output.out
         assert "--query" in output.out
         assert "Output has been written" in output.out
+
+
+def test_quoted_bin(capsys):
+    cfg = Config({"mca": {"bin": "'/opt/my java/java' -jar /opt/mca.jar"}}, False)
+    factory("overworld", cfg)._run(True, "select")
+
+    output = capsys.readouterr().out
+    assert "['/opt/my java/java', '-jar', '/opt/mca.jar', '--world'" in output
+
+
+def test_backup_plain_tar(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(subprocess, "call", lambda command, *args, **kwargs: 0)
+    cfg = Config({"mca": {"compress": "", "name": "%s.tar"}}, False)
+    manager = factory("overworld", cfg)
+    tmp_path.joinpath("chunks-the-overworld.csv").touch()
+
+    manager.backup(False)
+
+    assert "Backed up to the-overworld_" in capsys.readouterr().out
+    assert len(list(tmp_path.glob("the-overworld_*.tar"))) == 1
+    assert not tmp_path.joinpath("chunks-the-overworld").exists()
@@ -0,0 +1,286 @@
+import json
+import os
+import socket
+import subprocess
+import time
+from types import SimpleNamespace
+
+import click
+import pytest
+
+from cmcserver import server as server_module
+from cmcserver.configuration import Config
+from cmcserver.server import (
+    ServerManager,
+    _format_tellraw,
+    seconds_to_countdown,
+    seconds_to_time_text,
+    text_prefix,
+)
+
+config = Config(dict(), False)
+
+
+def patch_server(monkeypatch, server: ServerManager) -> list:
+    sent = []
+    monkeypatch.setattr(server, "screen_exists", lambda: True)
+    monkeypatch.setattr(server, "rcon_send", lambda commands: sent.extend(commands))
+    return sent
+
+
+def test_tell_all(monkeypatch, capsys):
+    server = ServerManager(config)
+    sent = patch_server(monkeypatch, server)
+
+    def expected(message_list):
+        return "/tellraw @a " + json.dumps(message_list, separators=(",", ":"))
+
+    server.tell_all('Say "hi"', play_sound=False)
+    message = {"text": 'Say "hi"', "color": "gray", "italic": False}
+    assert sent == [expected(text_prefix() + [message])]
+    assert 'Broadcasted: [SERVER] Say "hi"' in capsys.readouterr().out
+
+    sent.clear()
+    server.tell_all("Hi", color="red", italic=True, prefixed=False)
+    assert sent[0].startswith("/playsound minecraft:block.amethyst_block.resonate")
+    assert sent[1] == expected([{"text": "Hi", "color": "red", "italic": True}])
+
+    sent.clear()
+    formatted = [{"text": "A", "color": "blue"}, {"text": "B"}]
+    server.tell_all(formatted, play_sound=False)
+    assert sent == [expected(text_prefix() + formatted)]
+    assert "Broadcasted: [SERVER] AB" in capsys.readouterr().out
+
+    # Batched messages are left for the caller to send
+    sent.clear()
+    batch = []
+    server.tell_all("Hi", batch=batch)
+    assert not sent
+    assert len(batch) == 2
+
+
+def test_format_tellraw_matches_json():
+    for text in ["In 3...", "It's 50% done!", "tab\there", "back\\slash", "wörld", ""]:
+        component = json.loads(_format_tellraw(text, "gray", True))
+        assert component == {"text": text, "color": "gray", "italic": True}
+
+
+def test_wait_for_exit():
+    server = ServerManager(config)
+
+    child = subprocess.Popen(["sleep", "0.3"])
+    assert server._wait_for_exit(child.pid, 0.1) is False
+
+    # Reap it so the pid really goes away
+    child.wait()
+    assert server._wait_for_exit(child.pid, 5) is True
+
+
+def test_seconds_to_countdown():
+    assert seconds_to_countdown(0) == [(0, "10 seconds"), (5, None)]
+    assert seconds_to_countdown(60) == [
+        (0, "1 minute"),
+        (30, "30 seconds"),
+        (20, "10 seconds"),
+        (5, None),
+    ]
+    assert seconds_to_countdown(75)[:2] == [
+        (0, "1 minute and 15 seconds"),
+        (15, "1 minute"),
+    ]
+    # A custom range can be in any order
+    assert seconds_to_countdown(100, [5, 60, 30]) == seconds_to_countdown(
+        100,
+        [60, 30, 5],
+    )
+    assert seconds_to_time_text(125) == "2 minutes and 5 seconds"
+    assert seconds_to_time_text(5) == "5"
+    assert seconds_to_time_text(30) == "30 seconds"
+    assert seconds_to_time_text(60) == "1 minute"
+
+
+def test_keepalive():
+    with socket.socket() as sock:
+        ServerManager._keepalive(sock)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+
+
+def test_pipelined_send(monkeypatch):
+    from mctools.packet import RCONPacket
+
+    server = ServerManager(Config({"server": {"rcon_pipeline": True}}, False))
+    written = []
+    replies = [
+        RCONPacket(1, RCONPacket.RESPONSE, "first "),
+        RCONPacket(1, RCONPacket.RESPONSE, "split"),
+        RCONPacket(2, RCONPacket.RESPONSE, "second"),
+        RCONPacket(0, RCONPacket.RESPONSE, "Unknown request 0"),
+    ]
+
+    class Fake:
+        class proto:
+            write_tcp = written.append
+            read = staticmethod(lambda: replies.pop(0))
+
+        class formatters:
+            clean = staticmethod(lambda payload, command: payload)
+
+    monkeypatch.setattr(server, "_get_client", lambda: Fake)
+    assert server._raw_send(["/a", "/b"]) == [("/a", "first split"), ("/b", "second")]
+
+    # Both commands and the end marker go out in one write
+    assert len(written) == 1
+    assert written[0].count(b"/a") == 1 and written[0].count(b"/b") == 1
+
+
+def test_protocol_error_drops_login():
+    from mctools.errors import ProtoConnectionClosed
+
+    server = ServerManager(config)
+    stopped = []
+
+    class Dead:
+        def command(self, command):
+            raise ProtoConnectionClosed("closed")
+
+        def stop(self):
+            stopped.append(True)
+
+    server.client, server._authed = Dead(), True
+    with pytest.raises(ProtoConnectionClosed):
+        server._raw_send(["/list"])
+
+    # The next command logs in again rather than reusing the dead socket
+    assert stopped == [True]
+    assert server.client is None and not server._authed
+
+
+def test_ping_not_running(capsys):
+    # Nothing listens on port 1, so the ping fails straight away
+    server = ServerManager(Config({"server": {"rcon_port": 1}}, False))
+    assert server._ping_server() is False
+    assert server.client is None
+    assert "RCON connect timeout" in capsys.readouterr().out
+
+
+def test_refused_connect_keeps_resolved_host():
+    server_module._resolve.cache_clear()
+    server = ServerManager(Config({"server": {"rcon_port": 1}}, False))
+
+    # Every ping while start() waits is refused, none should look the host up
+    for _ in range(3):
+        assert server._ping_server() is False
+    assert server_module._resolve.cache_info().misses == 1
+
+
+def test_ping_success_is_reused(monkeypatch):
+    server = ServerManager(config)
+    logins = []
+    monkeypatch.setattr(server, "_get_client", lambda timeout: logins.append(timeout))
+
+    assert server._ping_server() is True
+    assert server._ping_server() is True
+    assert len(logins) == 1
+
+    # Closing the connection means asking again
+    server.close()
+    assert server._ping_server() is True
+    assert len(logins) == 2
+
+
+def test_screen_exists_from_socket_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("SCREENDIR", str(tmp_path))
+    server = ServerManager(config)
+
+    # A socket left behind by a dead session doesn't count
+    tmp_path.joinpath("999999999.mcs").touch()
+    tmp_path.joinpath(f"{os.getpid()}.other").touch()
+    assert server.screen_exists(fresh=True) is False
+
+    tmp_path.joinpath(f"{os.getpid()}.mcs").touch()
+    assert server.screen_exists(fresh=True) is True
+    assert server._screen_pid() == os.getpid()
+
+
+def test_start_backs_off(monkeypatch, capsys):
+    server = ServerManager(config)
+    monkeypatch.setattr(server, "screen_exists", lambda fresh=False: False)
+    monkeypatch.setattr(server, "_screen_start", lambda *args: True)
+
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    pings = iter([False, False, False, True])
+    monkeypatch.setattr(server, "_ping_server", lambda: next(pings))
+
+    server.start()
+    assert sleeps == [0.5, 0.75, 1.125]
+    assert "Server has been loaded." in capsys.readouterr().out
+
+
+def test_follow_holds_partial_lines(tmp_path, monkeypatch):
+    log = tmp_path.joinpath("screen.log")
+    log.write_text("old line\n")
+    writes = iter(["Starting", " server\nDone\n"])
+
+    class FakeINotify:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def add_watch(self, path, mask):
+            assert path == log
+
+        def read(self, timeout):
+            # Each wait for an event sees the next write land
+            with open(log, "a") as f:
+                f.write(next(writes))
+            return []
+
+    monkeypatch.setattr(server_module, "INotify", FakeINotify)
+    monkeypatch.setattr(
+        server_module,
+        "flags",
+        SimpleNamespace(MODIFY=2, CLOSE_WRITE=8),
+        raising=False,
+    )
+
+    lines = ServerManager(config)._follow(log)
+    assert next(lines) == ["Starting server\n", "Done\n"]
+
+
+def test_screen_exists_cached(monkeypatch):
+    server = ServerManager(config)
+    calls = []
+    monkeypatch.setattr(server, "_screen_pids", lambda: calls.append(1) or [123])
+
+    assert server.screen_exists() and server.screen_exists()
+    assert len(calls) == 1
+
+    # A start or stop makes the next check ask again
+    server._invalidate_screen_cache()
+    assert server.screen_exists()
+    assert len(calls) == 2
+
+
+def test_stop_survives_losing_the_server(monkeypatch, capsys):
+    server = ServerManager(config)
+    sent = []
+
+    def rcon_send(commands):
+        sent.append(list(commands))
+        if len(sent) > 1:
+            raise click.UsageError("Unable to connect to server")
+
+    monkeypatch.setattr(server, "screen_exists", lambda fresh=False: True)
+    monkeypatch.setattr(server, "rcon_send", rcon_send)
+    monkeypatch.setattr(server, "_screen_pid", lambda: None)
+    monkeypatch.setattr(server, "_wait_for_exit", lambda pid, timeout: True)
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+
+    server.stop(countdown=60)
+    out = capsys.readouterr().out
+    assert "Lost the server during the countdown" in out
+    assert "Server has stopped" in out
+    assert not any("/stop" in commands for commands in sent)
@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _cache_home(tmp_path, monkeypatch):
+    # Keep config caches written by Config.load out of the real ~/.cache
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))